@@ -10,6 +10,9 @@ from math import sqrt
 import math
 
 FILE_PATH = "mds_V2_5.372k.csv"
+# Columnar dataset written by the 07 app's /upload/ (Arrow parts per floor, WKB geometry).
+# When present only the requested floor is read, memory-mapped, instead of the whole CSV.
+DATASET_PATH = "datasets/mds_V2_5.372k"
 WALL_ENT_TYPE = 'separator'
 WALL_SUBTYPE = 'WALL'
 IGNORE_ROOMTYPES = {'Structure', 'Door', 'Window', 'Entrance Door', 'Balcony'}
@@ -432,14 +435,31 @@ def export_json(segments, rooms, room_types, room_apartments, out_path="output.j
         json.dump(data, f, indent=4)
 
 
+def load_floor_from_dataset(path: str, floor_id) -> gdf:
+    import numpy as np
+    import pyarrow as pa
+    import shapely
+    fdir = os.path.join(path, f"floor={floor_id}")
+    tables = [pa.ipc.open_file(pa.memory_map(os.path.join(fdir, p))).read_all()
+              for p in sorted(os.listdir(fdir))]
+    # parts are typed per upload chunk (an all-empty column reads as double in
+    # one and string in another), so let pandas reconcile them
+    floor_df = pd.concat([t.drop(['geom_wkb']).to_pandas() for t in tables], ignore_index=True)
+    floor_df['geom'] = np.concatenate([shapely.from_wkb(t.column('geom_wkb').to_numpy(zero_copy_only=False))
+                                       for t in tables])
+    return gdf(floor_df)
+
 if __name__ == "__main__":
-    if not os.path.exists(FILE_PATH):
-        raise FileNotFoundError(f"{FILE_PATH} not found")
-    df = pd.read_csv(FILE_PATH)
-    df['geom'] = df.geom.apply(wkt.loads)
-    df = gdf(df)
     FLOOR_ID = 9942
-    floor_df = df[df.floor_id == FLOOR_ID]
+    if os.path.exists(os.path.join(DATASET_PATH, "meta.json")):
+        floor_df = load_floor_from_dataset(DATASET_PATH, FLOOR_ID)
+    else:
+        if not os.path.exists(FILE_PATH):
+            raise FileNotFoundError(f"{FILE_PATH} not found")
+        df = pd.read_csv(FILE_PATH)
+        df['geom'] = df.geom.apply(wkt.loads)
+        df = gdf(df)
+        floor_df = df[df.floor_id == FLOOR_ID]
 
     segments, rooms, room_types, room_apartments = plot_floor_with_room_segment_graph(
         floor_df,
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Depends
 from fastapi.responses import FileResponse
 from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
@@ -10,13 +10,16 @@ if not hasattr(pd.DataFrame, "append"):
 import io
 import networkx as nx
 from networkx.algorithms.isomorphism import GraphMatcher
+import shapely
+from shapely import STRtree
 from shapely.wkt import loads as load_wkt
 from shapely.ops import unary_union
-from shapely.geometry import Polygon, MultiPoint, MultiLineString, LineString, Point,MultiPolygon
+from shapely.geometry import Polygon, LineString, Point,MultiPolygon
 
-from itertools import combinations
+from itertools import combinations, groupby, islice, permutations, product
 import numpy as np
 from gspan_mining.gspan import gSpan
+from gspan_mining.graph import Graph as GSpanGraph, AUTO_EDGE_ID, VACANT_VERTEX_LABEL
 from fastapi.responses import Response
 import matplotlib
 matplotlib.use("Agg")
@@ -26,12 +29,27 @@ import io
 from fastapi import Request 
 from collections import defaultdict
 import copy
+import functools
+import csv
 import pickle
 import os
 from fastapi.middleware.cors import CORSMiddleware
 import urllib.parse
 from fastapi import HTTPException, Query
-from collections import Counter
+from collections import Counter, OrderedDict
+import multiprocessing as mp
+import hashlib
+import heapq
+import json
+import re
+import shutil
+import tempfile
+import pyarrow as pa
+from fastapi.concurrency import run_in_threadpool
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 # Allow frontend to communicate with backend
 app = FastAPI()
 app.add_middleware(
@@ -49,21 +67,109 @@ os.makedirs(ENRICH_DIR, exist_ok=True)
 GRAPH_DIR = "saved_graphs"
 os.makedirs(GRAPH_DIR, exist_ok=True)
 
+STORE_DIR = "datasets"
+os.makedirs(STORE_DIR, exist_ok=True)
+
+MINE_CACHE_DIR = "mining_cache"
+os.makedirs(MINE_CACHE_DIR, exist_ok=True)
+
 # ----------------------------------------------------------------------
 # Inlined build_graph_for_apartment (no external dependency)
 # ----------------------------------------------------------------------
-def build_graph_for_apartment(DF, floor_id, apartment_id, buffer_dist=0.6, min_shared_len=0.1):
-    def get_geoms(df, fid, aid=None, col='roomtype'):
-        d = df[df.floor_id == fid]
-        if aid is not None:
-            d = d[d.apartment_id == aid]
-        geoms = d.geom.apply(load_wkt)
-        cats = d[col]
-        return list(geoms), list(cats)
-
-    geoms_all, cats_all = get_geoms(DF, floor_id)
-    structure = unary_union([g for g,c in zip(geoms_all,cats_all) if c=='Structure'])
-    polys = list(structure.geoms) if hasattr(structure,'geoms') else [structure]
+def _overlap_candidates(query_geoms, tree_geoms, min_shared_len, same_set=False):
+    """
+    Index pairs (q, t) whose envelopes overlap, sorted row-major so edges are
+    added in the same order as the former nested loops.
+    Pairs with disjoint envelopes share nothing, so they can only pass a
+    non-positive threshold; in that case every pair is returned.
+    """
+    nq, nt = len(query_geoms), len(tree_geoms)
+    if min_shared_len <= 0:
+        qi, ti = np.divmod(np.arange(nq * nt), nt) if nt else (np.empty(0, int), np.empty(0, int))
+    else:
+        qi, ti = STRtree(tree_geoms).query(query_geoms)
+    if same_set:
+        keep = qi < ti
+        qi, ti = qi[keep], ti[keep]
+    order = np.lexsort((ti, qi))
+    return qi[order], ti[order]
+
+def parse_geometries(df):
+    """
+    Decode the WKT `geom` column into a shapely geometry array aligned with
+    the rows of `df` (missing values become None).
+    """
+    wkt = df.geom.to_numpy(dtype=object)
+    return shapely.from_wkt(np.where(pd.isna(wkt), None, wkt))
+
+def build_partition_index(df):
+    """
+    Group the rows of `df` once: 'floors' maps each floor_id to its
+    apartment_ids (in order of appearance) and 'rows' maps each
+    (floor_id, apartment_id) to the positional row indices it occupies.
+    """
+    rows = df.groupby(['floor_id', 'apartment_id'], sort=False).indices
+    floors = {f: [] for f in df.floor_id.dropna().unique()}
+    for f, a in df[['floor_id', 'apartment_id']].dropna().drop_duplicates().itertuples(index=False, name=None):
+        floors[f].append(a)
+    return {'floors': floors, 'rows': rows}
+
+def rectify_rooms(room_geoms, buffer_dist, max_ratio=0.4, min_area_ratio=0.7):
+    """
+    Smooth every room polygon (buffer out/in, simplify) and snap it to its
+    minimum rotated rectangle when the Hausdorff distance is below
+    `max_ratio` of the mean side length and the rectangle is filled to more
+    than `min_area_ratio`. All rooms are processed in one batch of array
+    operations; non-polygons pass through unchanged.
+    """
+    geoms = np.array(room_geoms, dtype=object)
+    is_poly = shapely.get_type_id(geoms) == 3
+    sm = geoms.copy()
+    sm[is_poly] = shapely.simplify(
+        shapely.buffer(shapely.buffer(geoms[is_poly], buffer_dist, quad_segs=16), -buffer_dist, quad_segs=16),
+        0.05,
+    )
+    final = sm.copy()
+    idx = np.flatnonzero(shapely.get_type_id(sm) == 3)
+    if len(idx) == 0:
+        return final
+
+    poly = sm[idx]
+    rect = shapely.oriented_envelope(poly)
+    rect_ring = shapely.get_exterior_ring(rect)
+    hd = shapely.hausdorff_distance(shapely.get_exterior_ring(poly), rect_ring)
+
+    # mean of the first four rectangle sides, 1.0 when it has fewer
+    counts = shapely.get_num_coordinates(rect_ring)
+    coords = shapely.get_coordinates(rect_ring)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    has_sides = counts >= 5
+    avg = np.ones(len(idx))
+    if has_sides.any():
+        xy = np.stack([coords[starts[has_sides] + k] for k in range(5)], axis=1)
+        d = np.diff(xy, axis=1)
+        sides = np.hypot(d[..., 0], d[..., 1])
+        avg[has_sides] = (sides[:, 0] + sides[:, 1] + sides[:, 2] + sides[:, 3]) / 4
+
+    rect_area = shapely.area(rect)
+    area_ratio = shapely.area(poly) / np.where(rect_area != 0, rect_area, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(avg != 0, hd / avg, 999)
+    snap = (ratio < max_ratio) & (min_area_ratio < area_ratio)
+    final[idx[snap]] = rect[snap]
+    return final
+
+def build_graph_for_apartment(DF, floor_id, apartment_id, buffer_dist=0.6, min_shared_len=0.1, parsed_geoms=None, index=None):
+    # parsed_geoms: optional array from parse_geometries(DF), reused instead of re-parsing WKT
+    # index: optional build_partition_index(DF), replaces the full-frame filter
+    def get_geoms(df, fid, aid, col='roomtype'):
+        if index is not None:
+            sel = index['rows'].get((fid, aid), np.empty(0, dtype=np.intp))
+        else:
+            sel = ((df.floor_id == fid) & (df.apartment_id == aid)).to_numpy()
+        d = df.iloc[sel]
+        g = parsed_geoms[sel] if parsed_geoms is not None else parse_geometries(d)
+        return list(g), list(d[col])
 
     G = nx.Graph()
     apt_node = f"apartment_{apartment_id}"
@@ -72,48 +178,57 @@ def build_graph_for_apartment(DF, floor_id, apartment_id, buffer_dist=0.6, min_s
     geoms, cats = get_geoms(DF, floor_id, apartment_id)
     room_idxs = [i for i,(g,c) in enumerate(zip(geoms,cats)) if c not in ('Structure','Door','Window','Entrance Door','Balcony','Shaft')]
 
-    for i in room_idxs:
+    rect_geoms = rectify_rooms([geoms[i] for i in room_idxs], buffer_dist)
+    for i, final in zip(room_idxs, rect_geoms):
         rn = f"room_{apartment_id}_{i}"
-        geom = geoms[i]
-        sm = geom.buffer(buffer_dist).buffer(-buffer_dist).simplify(0.05) if isinstance(geom, Polygon) else geom
-        if isinstance(sm, Polygon):
-            rect = sm.minimum_rotated_rectangle
-            hd = sm.exterior.hausdorff_distance(rect.exterior)
-            sides = [np.hypot(x2-x1, y2-y1) for (x1,y1),(x2,y2) in zip(rect.exterior.coords, rect.exterior.coords[1:])]
-            avg = sum(sides[:4])/4 if len(sides)>=4 else 1.0
-            area_ratio = sm.area/(rect.area or 1)
-            ratio = hd/avg if avg else 999
-            final = rect if ratio<0.4 and 0.7<area_ratio else sm
-        else:
-            final = sm
-
         G.add_node(rn, type='room', roomtype=cats[i], apartment_id=apartment_id, geometry=final)
         G.add_edge(apt_node, rn, edge_type='apartment-room')
 
-    for i,j in combinations(room_idxs,2):
-        shared = geoms[i].buffer(buffer_dist).intersection(geoms[j]).area / buffer_dist
-        if shared >= min_shared_len:
-            u,v = f"room_{apartment_id}_{i}", f"room_{apartment_id}_{j}"
-            G.add_edge(u, v, edge_type='room-room', shared_length=shared)
+    # buffer every room once; exact overlap areas only for envelope-overlapping pairs
+    room_geoms = np.array([geoms[i] for i in room_idxs], dtype=object)
+    # quad_segs=16 matches the Geometry.buffer default used before
+    room_bufs = shapely.buffer(room_geoms, buffer_dist, quad_segs=16)
+
+    qi, ti = _overlap_candidates(room_bufs, room_geoms, min_shared_len, same_set=True)
+    shared = shapely.area(shapely.intersection(room_bufs[qi], room_geoms[ti])) / buffer_dist
+    for a, b, s in zip(qi, ti, shared):
+        if s >= min_shared_len:
+            u,v = f"room_{apartment_id}_{room_idxs[a]}", f"room_{apartment_id}_{room_idxs[b]}"
+            G.add_edge(u, v, edge_type='room-room', shared_length=float(s))
 
     wall_idxs = [i for i,(g,c) in enumerate(zip(geoms,cats)) if c=='Structure']
-    for ri in room_idxs:
-        buf = geoms[ri].buffer(buffer_dist)
-        for wi in wall_idxs:
-            shared = buf.intersection(geoms[wi]).area / buffer_dist
-            if shared >= min_shared_len:
-                wn = f"wall_{apartment_id}_{wi}"
-                if not G.has_node(wn):
-                    G.add_node(wn, type='wall', geometry=geoms[wi])
-                G.add_edge(f"room_{apartment_id}_{ri}", wn, edge_type='room-wall')
+    wall_geoms = np.array([geoms[i] for i in wall_idxs], dtype=object)
+    qi, ti = _overlap_candidates(room_bufs, wall_geoms, min_shared_len)
+    shared = shapely.area(shapely.intersection(room_bufs[qi], wall_geoms[ti])) / buffer_dist
+    for a, b, s in zip(qi, ti, shared):
+        if s >= min_shared_len:
+            ri, wi = room_idxs[a], wall_idxs[b]
+            wn = f"wall_{apartment_id}_{wi}"
+            if not G.has_node(wn):
+                G.add_node(wn, type='wall', geometry=geoms[wi])
+            G.add_edge(f"room_{apartment_id}_{ri}", wn, edge_type='room-wall')
+
+    add_wall_wall_edges(G)
+    return G
 
+def add_wall_wall_edges(G):
+    """
+    Link every pair of wall nodes whose geometries intersect (touching
+    included), weighted by the length their boundaries share. Candidates come
+    from an envelope index queried with prepared geometries, and edges are
+    added in wall-node order.
+    """
     walls = [n for n,d in G.nodes(data=True) if d.get('type')=='wall']
-    for u,v in combinations(walls,2):
-        gu, gv = G.nodes[u]['geometry'], G.nodes[v]['geometry']
-        if gu.touches(gv) or gu.intersects(gv):
-            slen = getattr(gu.boundary.intersection(gv.boundary), 'length', 0.0)
-            G.add_edge(u, v, edge_type='wall-wall', shared_length=slen)
-
+    wall_geoms = np.array([G.nodes[n]['geometry'] for n in walls], dtype=object)
+    shapely.prepare(wall_geoms)
+    qi, ti = STRtree(wall_geoms).query(wall_geoms, predicate='intersects')
+    keep = qi < ti
+    qi, ti = qi[keep], ti[keep]
+    order = np.lexsort((ti, qi))
+    qi, ti = qi[order], ti[order]
+    slens = shapely.length(shapely.intersection(shapely.boundary(wall_geoms[qi]), shapely.boundary(wall_geoms[ti])))
+    for a, b, slen in zip(qi, ti, slens):
+        G.add_edge(walls[a], walls[b], edge_type='wall-wall', shared_length=float(slen))
     return G
 
 # ----------------------------------------------------------------------
@@ -133,44 +248,260 @@ async def serve_ui():
     return FileResponse("app/static/index.html")
 
 # driver = GraphDatabase.driver("bolt://localhost:7687", auth=("neo4j","apartment-graph"))
-GSPAN_INPUT = "room_graphs.gspan"
 
 def get_db_session():
     return driver.session()
 
+# ----------------------------------------------------------------------
+# Worker pools
+# ----------------------------------------------------------------------
+# Data every task of a pool needs (encoded graphs for shard mining, room
+# label graphs for matching, the dataset for graph building), handed to
+# each worker once, at start-up, instead of once per task.
+_WORKER_PAYLOAD = None
+
+def _init_worker(payload):
+    global _WORKER_PAYLOAD
+    _WORKER_PAYLOAD = payload
+
+def worker_map(fn, tasks, payload, workers, chunksize=1):
+    """
+    pool.map(fn, tasks) over `workers` new processes that see `payload` as
+    _WORKER_PAYLOAD; results come in task order. Workers are started from
+    a forkserver (spawn where there is none) rather than forked from this
+    process, whose request and job threads may hold a lock such as
+    _FLOOR_CACHE_LOCK that a forked child would inherit held. Pending tasks
+    are cancelled when the caller stops early, fails or is cancelled.
+    """
+    if 'forkserver' in mp.get_all_start_methods():
+        ctx = mp.get_context('forkserver')
+        ctx.set_forkserver_preload([__name__])  # fork workers with this module imported
+    else:
+        ctx = mp.get_context('spawn')
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                               initargs=(payload,))
+    try:
+        yield from pool.map(fn, tasks, chunksize=chunksize)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
 # ----------------------------------------------------------------------
 # gSpan helpers
 # ----------------------------------------------------------------------
-def export_gspan_input(graphs, out_file):
-    with open(out_file, 'w') as fout:
-        for gid, G in graphs:
-            edges = [(u,v) for u,v,d in G.edges(data=True) if d.get('edge_type')=='room-room']
-            if not edges: continue
-            nodes = sorted({n for u,v in edges for n in (u,v)})
-            vid = {n:i for i,n in enumerate(nodes)}
-            fout.write(f"t # {gid}\n")
-            for n in nodes:
-                fout.write(f"v {vid[n]} {G.nodes[n].get('roomtype','Unknown')}\n")
-            for u,v in edges:
-                fout.write(f"e {vid[u]} {vid[v]} 1\n")
-
-def run_mining(gspan_file, min_sup):
-    gs = gSpan(gspan_file, min_sup, True)
+class _MemoryGSpan(gSpan):
+    """
+    gSpan over graphs built in memory, collecting patterns instead of
+    printing them. With top_k, the support threshold rises to the k-th best
+    support reported so far; with a deadline (a time.monotonic() value), no
+    DFS code is extended once it has passed and timed_out is set.
+    """
+    def __init__(self, graphs, min_support, top_k=None, deadline=None, **kwargs):
+        super().__init__(None, min_support, **kwargs)
+        self._input_graphs = graphs
+        self._top_k = top_k
+        self._best = []  # min-heap of the top_k supports reported so far
+        self._deadline = deadline
+        self.timed_out = False
+        self.patterns = []
+
+    def _read_graphs(self):
+        self.graphs = self._input_graphs
+
+    def _report_size1(self, g, support):
+        pass
+
+    def _report(self, projected):
+        if self._DFScode.get_num_vertices() < self._min_num_vertices:
+            return
+        code = tuple((e.frm, e.to, e.vevlb) for e in self._DFScode)
+        self.patterns.append((code, self._support))
+        if self._top_k:
+            heapq.heappush(self._best, self._support)
+            if len(self._best) > self._top_k:
+                heapq.heappop(self._best)
+            if len(self._best) == self._top_k:
+                # support only drops as a code grows: nothing below the k-th best can still make it
+                self._min_support = max(self._min_support, self._best[0])
+
+    def _subgraph_mining(self, projected):
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            self.timed_out = True
+            return
+        return super()._subgraph_mining(projected)
+
+def top_k_patterns(patterns, k):
+    """Positions of the k patterns with the highest support, most frequent first (ties by DFS code)."""
+    return sorted(range(len(patterns)), key=lambda i: (-patterns[i]["support"], patterns[i]["code"]))[:k]
+
+def top_k_min_support(patterns, k, min_support):
+    """Support threshold in effect once only the top k patterns are kept."""
+    if len(patterns) < k:
+        return min_support
+    return max(min_support, min(p["support"] for p in patterns))
+
+def room_room_graph(C):
+    """
+    Rooms of compact graph C that share a room-room edge, sorted by node id,
+    with their roomtypes and the (u, v) node positions of those edges.
+    """
+    us, vs, _ = compact_edges(C, 'room-room')
+    names = C['nodes']
+    nodes = sorted({int(n) for n in np.concatenate([us, vs])}, key=lambda n: names[n])
+    labels = [str(C['roomtypes'][C['label'][n]]) if C['label'][n] >= 0 else 'Unknown' for n in nodes]
+    return nodes, labels, us.tolist(), vs.tolist()
+
+def encode_room_graphs(graphs):
+    """
+    Encode the room-room graphs of (gid, compact graph) pairs for gSpan as
+    (label codes, local edges) pairs, skipping graphs without room-room
+    edges. Roomtypes become integer codes ranked like the strings, so
+    patterns and their canonical DFS codes match a run on the text labels.
+    Returns the encoded graphs and the label vocabulary.
+    """
+    rr = [room_room_graph(C) for gid, C in graphs]
+    rr = [e for e in rr if e[2]]
+    vocab = sorted({l for _, labels, _, _ in rr for l in labels})
+    code = {l: i for i, l in enumerate(vocab)}
+    encoded = []
+    for nodes, labels, us, vs in rr:
+        vid = {n: i for i, n in enumerate(nodes)}
+        encoded.append(([code[l] for l in labels], [(vid[u], vid[v]) for u, v in zip(us, vs)]))
+    return encoded, vocab
+
+def gspan_graph(k, labels, edges):
+    g = GSpanGraph(k, is_undirected=True, eid_auto_increment=True)
+    for i, l in enumerate(labels):
+        g.add_vertex(i, l)
+    for u, v in edges:
+        g.add_edge(AUTO_EDGE_ID, u, v, 1)
+    return g
+
+def gspan_graphs(graphs):
+    """gSpan graphs of (gid, compact graph) pairs, and the label vocabulary."""
+    encoded, vocab = encode_room_graphs(graphs)
+    return {k: gspan_graph(k, *e) for k, e in enumerate(encoded)}, vocab
+
+def make_pattern(code, support, vocab):
+    """
+    Structured pattern from a DFS code: vertex labels by pattern vertex id,
+    edges, support, and the DFS-string description the API reports.
+    """
+    labels = {}
+    for frm, to, (l1, _, l2) in code:
+        if l1 != VACANT_VERTEX_LABEL: labels.setdefault(frm, vocab[l1])
+        if l2 != VACANT_VERTEX_LABEL: labels.setdefault(to, vocab[l2])
+    edges = [(frm, to) for frm, to, _ in code]
+    # same layout as gspan's Graph.display(): vertices, then edges from the lower id
+    desc = ''.join(f"v {v} {l} " for v, l in labels.items())
+    adj = defaultdict(list)
+    for frm, to in edges:
+        adj[frm].append(to); adj[to].append(frm)
+    desc += ''.join(f"e {u} {v} 1 " for u in labels for v in adj[u] if u < v)
+    return {"code": code, "labels": labels, "edges": edges, "support": support,
+            "num_vert": len(labels), "description": desc}
+
+def mine_frequent_patterns(graphs, min_sup, min_vertices=1, max_vertices=float('inf'),
+                           top_k=None, time_budget=None, status=None):
+    """
+    Frequent room-room patterns (two or more rooms) of (gid, compact graph)
+    pairs with between min_vertices and max_vertices rooms. gSpan stops
+    growing DFS codes at max_vertices and does not report smaller codes.
+
+    top_k keeps the k most frequent patterns, most frequent first, raising
+    the support threshold as they are found. time_budget (seconds) stops
+    growing DFS codes once spent. `status` (optional dict) receives
+    'partial' (the budget ran out) and the final 'min_support'.
+    """
+    gs_graphs, vocab = gspan_graphs(graphs)
+    deadline = time.monotonic() + time_budget if time_budget else None
+    gs = _MemoryGSpan(gs_graphs, min_sup, top_k=top_k, deadline=deadline,
+                      min_num_vertices=min_vertices, max_num_vertices=max_vertices)
     gs.run()
-    df = gs._report_df
-    supcol = next(c for c in df.columns if 'sup' in c.lower())
-    codecol = next(c for c in df.columns if c!=supcol)
-    return list(zip(df[codecol], df[supcol]))
-
-def parse_pattern(desc):
-    P=nx.Graph(); toks=desc.split(); i=0
-    while i<len(toks):
-        if toks[i]=='v' and i+2<len(toks):
-            vid,lbl=int(toks[i+1]),toks[i+2]; P.add_node(vid,label=lbl); i+=3
-        elif toks[i]=='e' and i+3<len(toks):
-            u,v=int(toks[i+1]),int(toks[i+2]); P.add_edge(u,v); i+=4
-        else:
-            i+=1
+    patterns = [make_pattern(code, sup, vocab) for code, sup in gs.patterns]
+    if top_k:
+        patterns = [patterns[i] for i in top_k_patterns(patterns, top_k)]
+    if status is not None:
+        status.update(partial=gs.timed_out, min_support=gs._min_support)
+    return patterns
+
+def _mine_shard(task, encoded=None):
+    lo, hi, local_sup, min_vertices, max_vertices = task
+    encoded = encoded or _WORKER_PAYLOAD
+    gs = _MemoryGSpan({k: gspan_graph(k, *encoded[k]) for k in range(lo, hi)}, local_sup,
+                      min_num_vertices=min_vertices, max_num_vertices=max_vertices)
+    gs.run()
+    return gs.patterns
+
+def mine_partitioned(graphs, min_sup, min_vertices=1, max_vertices=float('inf'), shards=4, workers=1, job=None):
+    """
+    Same patterns as mine_frequent_patterns, mined shard by shard (SON).
+    Each of `shards` slices of the graphs is mined with the support scaled
+    to its size, rounded up; a globally frequent pattern reaches that in at
+    least one shard. Shards run over `workers` processes.
+
+    A candidate's support is exact in the shards that reported it and below
+    their threshold in the others, so candidates that cannot reach min_sup
+    are dropped, and the rest are counted with a monomorphism test only in
+    the shards that did not report them. Patterns are returned ordered by
+    DFS code.
+    """
+    encoded, vocab = encode_room_graphs(graphs)
+    n = len(encoded)
+    if not n:
+        return []
+    bounds = np.linspace(0, n, min(shards, n) + 1).astype(int)
+    tasks = [(lo, hi, max(1, -(-min_sup * (hi - lo) // n)), min_vertices, max_vertices)
+             for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+
+    candidates = defaultdict(dict)  # code -> {shard: local support}
+    def merge(t, found):
+        for code, sup in found:
+            candidates[code][t] = sup
+        job_update(job, "mining shards", t + 1)
+
+    job_update(job, "mining shards", 0, len(tasks))
+    if workers <= 1 or len(tasks) <= 1:
+        for t, task in enumerate(tasks):
+            merge(t, _mine_shard(task, encoded))
+    else:
+        for t, found in enumerate(worker_map(_mine_shard, tasks, encoded, workers)):
+            merge(t, found)
+
+    # global support of every candidate
+    label_graphs = []
+    for k, (labels, edges) in enumerate(encoded):
+        H = nx.Graph()
+        H.add_nodes_from((i, {"label": l}) for i, l in enumerate(labels))
+        H.add_edges_from(edges)
+        label_graphs.append((k, H))
+    index = build_label_index(label_graphs)
+    shard_of = np.repeat(np.arange(len(tasks)), np.diff(bounds))
+    patterns = []
+    for c, code in enumerate(sorted(candidates)):
+        job_update(job, "verifying", c, len(candidates))
+        local = candidates[code]
+        missing = [t for t in range(len(tasks)) if t not in local]
+        if sum(local.values()) + sum(tasks[t][2] - 1 for t in missing) < min_sup:
+            continue
+        pat = make_pattern(code, 0, vocab)
+        P = nx.Graph()
+        P.add_nodes_from((v, {"label": vocab.index(l)}) for v, l in pat['labels'].items())
+        P.add_edges_from(pat['edges'])
+        sup = sum(local.values()) + sum(
+            1 for g in candidate_graphs(index, P)
+            if shard_of[g] not in local
+            and GraphMatcher(label_graphs[g][1], P, node_match=lambda a, b: a['label'] == b['label'])
+            .subgraph_is_monomorphic())
+        if sup >= min_sup:
+            pat['support'] = sup
+            patterns.append(pat)
+    return patterns
+
+def pattern_graph(pattern):
+    P = nx.Graph()
+    for v, l in pattern['labels'].items():
+        P.add_node(v, label=l)
+    P.add_edges_from(pattern['edges'])
     return P
 
 def normalize_dfs(desc: str) -> str:
@@ -195,35 +526,126 @@ def normalize_dfs(desc: str) -> str:
 
 
 # ----------------------------------------------------------------------
-# Spatial constraints & matching
+# Mining cache
 # ----------------------------------------------------------------------
-def compute_shape_violation(room_polys, threshold):
-    coords = []
-    lines = []
-
-    for poly in room_polys:
-        if isinstance(poly, Polygon):
-            coords.extend(poly.exterior.coords)
-            lines.append(poly.exterior)
-        elif isinstance(poly, MultiPolygon):
-            for p in poly.geoms:
-                coords.extend(p.exterior.coords)
-                lines.append(p.exterior)
-
-    multi = MultiPoint(coords)
-    rect = multi.convex_hull.minimum_rotated_rectangle
-    mline = MultiLineString(lines)
-    hausd = mline.hausdorff_distance(rect.exterior)
-
-    avg = rect.length / 4.0 if hasattr(rect, 'length') else 1.0
-    ratio = hausd / avg if avg else 999
-
-    return max(0.0, ratio - threshold), ratio, hausd, rect
+# Raw frequent patterns and the support threshold they were mined at (plus
+# the match rows, for engine=esu), pickled per (graph set, mining parameters) key.
+# The graph set digest covers every saved graph's name, size and mtime, so
+# any graph that process_all (or /process) rewrites or removes changes the
+# key. Entries are evicted least-recently-used beyond the caps below.
+MINE_CACHE_INDEX = os.path.join(MINE_CACHE_DIR, "index.json")
+MINE_CACHE_MAX_ENTRIES = 32
+MINE_CACHE_MAX_BYTES = 512 * 2**20
+# Bump when the layout of a cache entry changes, so older entries are not read.
+MINE_CACHE_FORMAT = 2
+_MINE_CACHE_LOCK = threading.Lock()
+
+def graph_set_digest(gids):
+    h = hashlib.sha1()
+    for gid in gids:
+        st = os.stat(os.path.join(GRAPH_DIR, f"{gid}.npz"))
+        h.update(f"{gid}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+def mining_cache_key(digest, **params):
+    return hashlib.sha1(json.dumps([digest, params], sort_keys=True).encode()).hexdigest()
+
+def _load_mine_cache_index():
+    try:
+        with open(MINE_CACHE_INDEX) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _save_mine_cache_index(index):
+    tmp = MINE_CACHE_INDEX + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, MINE_CACHE_INDEX)
+
+def mining_cache_get(key):
+    with _MINE_CACHE_LOCK:
+        index = _load_mine_cache_index()
+        if key not in index:
+            return None
+        try:
+            with open(os.path.join(MINE_CACHE_DIR, f"{key}.pkl"), "rb") as f:
+                entry = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            del index[key]
+            _save_mine_cache_index(index)
+            return None
+        index[key]["used"] = time.time()
+        _save_mine_cache_index(index)
+        return entry
+
+def mining_cache_put(key, entry):
+    path = os.path.join(MINE_CACHE_DIR, f"{key}.pkl")
+    with _MINE_CACHE_LOCK:
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(entry, f)
+        os.replace(path + ".tmp", path)
+        index = _load_mine_cache_index()
+        index[key] = {"size": os.path.getsize(path), "used": time.time()}
+        total = sum(e["size"] for e in index.values())
+        for k in sorted(index, key=lambda k: index[k]["used"]):
+            if len(index) <= MINE_CACHE_MAX_ENTRIES and total <= MINE_CACHE_MAX_BYTES:
+                break
+            total -= index.pop(k)["size"]
+            try:
+                os.remove(os.path.join(MINE_CACHE_DIR, f"{k}.pkl"))
+            except FileNotFoundError:
+                pass
+        _save_mine_cache_index(index)
 
-def compute_rect_dimensions(rect):
-    pts = list(rect.exterior.coords)
-    lens = [np.hypot(pts[i+1][0]-pts[i][0], pts[i+1][1]-pts[i][1]) for i in range(len(pts)-1)]
-    return min(lens), max(lens) if lens else (0.0, 0.0)
+# ----------------------------------------------------------------------
+# Spatial constraints & matching
+# ----------------------------------------------------------------------
+def score_shape_violations(matches, threshold):
+    """
+    How far each match's rooms are from filling a rectangle. `matches` is
+    a list of room polygon lists. The exterior rings of the rooms are
+    compared with the minimum rotated rectangle around them: hausd is their
+    Hausdorff distance, ratio that distance over the rectangle's mean side,
+    viol how far ratio exceeds `threshold`, and width the rectangle's short
+    side. Returns arrays viol, ratio, hausd and width, one entry per match. Hulls, rectangles and Hausdorff distances go through
+    shapely's array functions and side lengths through numpy, so there is
+    no per-match Python geometry code. A match whose rectangle degenerates
+    to a line or point gets NaN.
+    """
+    n = len(matches)
+    geoms = np.array([p for polys in matches for p in polys], dtype=object)
+    owner = np.repeat(np.arange(n), [len(polys) for polys in matches])
+    # exterior rings of every polygon part
+    parts, part_idx = shapely.get_parts(geoms, return_index=True)
+    is_poly = shapely.get_type_id(parts) == 3
+    rings = shapely.get_exterior_ring(parts[is_poly])
+    ring_owner = owner[part_idx[is_poly]]
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+
+    # one multipoint and one multilinestring per match; matches without a polygon stay None
+    points, lines = np.empty(n, dtype=object), np.empty(n, dtype=object)
+    shapely.multipoints(coords, indices=ring_owner[coord_ring], out=points)
+    shapely.multilinestrings(shapely.linestrings(coords, indices=coord_ring), indices=ring_owner, out=lines)
+    rects = shapely.oriented_envelope(shapely.convex_hull(points))
+    rect_rings = shapely.get_exterior_ring(rects)
+    hausd = shapely.hausdorff_distance(lines, rect_rings)
+
+    avg = shapely.length(rects) / 4.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(avg != 0, hausd / avg, 999.0)
+    viol = np.maximum(0.0, ratio - threshold)
+
+    # shortest side of each rectangle: consecutive vertices of the same ring
+    width = np.full(n, np.nan)
+    rc, rc_idx = shapely.get_coordinates(rect_rings, return_index=True)
+    same = rc_idx[1:] == rc_idx[:-1]
+    sides = np.hypot(*(rc[1:] - rc[:-1])[same].T)
+    side_owner = rc_idx[1:][same]
+    if len(sides):
+        starts = np.flatnonzero(np.r_[True, side_owner[1:] != side_owner[:-1]])
+        width[side_owner[starts]] = np.minimum.reduceat(sides, starts)
+    return viol, ratio, hausd, width
 
 def is_valid_no_partial_cross(room_polys, tol=1e-7):
     for a,b in combinations(room_polys,2):
@@ -247,23 +669,74 @@ def is_valid_no_partial_cross(room_polys, tol=1e-7):
 #     )
 #     return list(matcher.subgraph_isomorphisms_iter())
 
-def find_matches(G, P):
-    # Build room-room subgraph from G with label normalization
+def room_label_graph(G):
+    """
+    Room-room subgraph of G with normalized roomtype labels, the graph that
+    patterns are matched against. Compact graphs are keyed by node position,
+    so their matches map positions to pattern ids.
+    """
     H = nx.Graph()
-    for n, d in G.nodes(data=True):
-        if d.get('type') == 'room':
-            roomtype = d.get('roomtype', '').strip().lower()
-            H.add_node(n, label=roomtype)
-    for u, v, d in G.edges(data=True):
-        if d.get('edge_type') == 'room-room' and u in H and v in H:
-            H.add_edge(u, v, label='1')
-
-    # Normalize pattern node and edge labels
+    if isinstance(G, dict):
+        lower = [t.strip().lower() for t in G['roomtypes'].tolist()]
+        for i in np.flatnonzero(G['kind'] == NODE_KINDS.index('room')).tolist():
+            H.add_node(i, label=lower[G['label'][i]] if G['label'][i] >= 0 else '')
+        us, vs, _ = compact_edges(G, 'room-room')
+        for u, v in zip(us.tolist(), vs.tolist()):
+            if u in H and v in H:
+                H.add_edge(u, v, label='1')
+    else:
+        for n, d in G.nodes(data=True):
+            if d.get('type') == 'room':
+                roomtype = d.get('roomtype', '').strip().lower()
+                H.add_node(n, label=roomtype)
+        for u, v, d in G.edges(data=True):
+            if d.get('edge_type') == 'room-room' and u in H and v in H:
+                H.add_edge(u, v, label='1')
+    return H
+
+# Room label graphs by gid, reused across /mine calls while the saved graph
+# (its pickle's size and mtime) is unchanged. Concurrent /mine calls share
+# it, so it is only touched under its lock; least recently used entries
+# go beyond LABEL_GRAPH_CACHE_MAX.
+_LABEL_GRAPH_CACHE = OrderedDict()
+_LABEL_GRAPH_CACHE_LOCK = threading.Lock()
+LABEL_GRAPH_CACHE_MAX = 20_000
+
+def cached_room_label_graph(gid, G):
+    try:
+        st = os.stat(os.path.join(GRAPH_DIR, f"{gid}.npz"))
+    except FileNotFoundError:
+        return room_label_graph(G)
+    stamp = (st.st_size, st.st_mtime_ns)
+    with _LABEL_GRAPH_CACHE_LOCK:
+        hit = _LABEL_GRAPH_CACHE.get(gid)
+        if hit is not None and hit[0] == stamp:
+            _LABEL_GRAPH_CACHE.move_to_end(gid)
+            return hit[1]
+    H = room_label_graph(G)
+    with _LABEL_GRAPH_CACHE_LOCK:
+        _LABEL_GRAPH_CACHE[gid] = (stamp, H)
+        _LABEL_GRAPH_CACHE.move_to_end(gid)
+        while len(_LABEL_GRAPH_CACHE) > LABEL_GRAPH_CACHE_MAX:
+            _LABEL_GRAPH_CACHE.popitem(last=False)
+    return H
+
+def prune_label_graph_cache(gids):
+    """Drop cached label graphs of gids not in `gids` (graphs that no longer exist)."""
+    with _LABEL_GRAPH_CACHE_LOCK:
+        for gid in _LABEL_GRAPH_CACHE.keys() - set(gids):
+            del _LABEL_GRAPH_CACHE[gid]
+
+def normalize_pattern(P):
+    # Normalize pattern node and edge labels (in place)
     for n in P.nodes:
         P.nodes[n]['label'] = P.nodes[n].get('label', '').strip().lower()
     for u, v in P.edges:
         P[u][v]['label'] = '1'
+    return P
 
+def match_pattern(H, P):
+    """All monomorphisms of normalized pattern P into room label graph H."""
     matcher = nx.algorithms.isomorphism.GraphMatcher(
         H, P,
         node_match=lambda nd, md: nd['label'] == md['label'],
@@ -277,6 +750,261 @@ def find_matches(G, P):
         # Fallback: simulate monomorphism via isomorphism matches
         return list(matcher.subgraph_isomorphisms_iter())
 
+def build_label_index(label_graphs):
+    """
+    Inverted index over room label graphs: normalized roomtype ->
+    {graph position: rooms with that label}, plus each graph's degree
+    sequence (descending) and edge count, for pruning before VF2.
+    """
+    labels = defaultdict(dict)
+    degrees, edges = [], []
+    for i, (gid, H) in enumerate(label_graphs):
+        for l, c in Counter(nx.get_node_attributes(H, 'label').values()).items():
+            labels[l][i] = c
+        degrees.append(np.sort(np.fromiter((d for _, d in H.degree), dtype=np.int64, count=len(H)))[::-1])
+        edges.append(H.number_of_edges())
+    return {"labels": labels, "degrees": degrees, "edges": edges}
+
+def candidate_graphs(index, P):
+    """
+    Positions of the graphs that can contain pattern P: enough rooms of
+    every pattern label, enough edges, and a degree sequence dominating
+    P's, since a monomorphism never maps a room onto one of lower degree.
+    """
+    need = Counter(nx.get_node_attributes(P, 'label').values())
+    cands = None
+    for l, c in sorted(need.items(), key=lambda lc: len(index["labels"].get(lc[0], ()))):
+        have = index["labels"].get(l, {})
+        cands = {i for i in (have if cands is None else cands) if have.get(i, 0) >= c}
+        if not cands:
+            return []
+    p_deg = np.sort(np.fromiter((d for _, d in P.degree), dtype=np.int64, count=len(P)))[::-1]
+    m = P.number_of_edges()
+    return [i for i in sorted(cands)
+            if index["edges"][i] >= m and np.all(index["degrees"][i][:len(p_deg)] >= p_deg)]
+
+# Matching workers get the room label graphs as their payload, so tasks
+# carry only a pattern and graph positions, never geometry.
+MATCH_TASK_GRAPHS = 64
+
+def _match_task(task, label_graphs=None):
+    k, pat, cands = task
+    label_graphs = label_graphs or _WORKER_PAYLOAD
+    P = normalize_pattern(pattern_graph(pat))
+    rows = []
+    for g in cands:
+        gid, H = label_graphs[g]
+        for mapping in match_pattern(H, P):
+            inv = {pid: gn for gn, pid in mapping.items()}
+            rows.append({"pattern": k, "gid": gid, "rooms": tuple(inv[i] for i in sorted(inv)),
+                         "mapping": mapping})
+    return rows
+
+def iter_match_table(patterns, graphs, job=None, workers=1, stats=None):
+    """
+    Match every pattern against every (gid, graph) once, yielding the rows
+    of the match table. Each row records the pattern's index in `patterns`,
+    the gid, the matched rooms ordered by pattern vertex, and the VF2
+    mapping {room: vertex}. Rows come pattern by pattern, then graph by
+    graph, also when the (pattern, graphs) tasks run over a pool of
+    `workers` processes. Graphs ruled out by the label index are skipped;
+    `stats` (optional dict) receives the number of (pattern, graph) pairs
+    checked and pruned before the first row.
+    """
+    label_graphs = [(gid, cached_room_label_graph(gid, G)) for gid, G in graphs]
+    prune_label_graph_cache(dict(graphs))
+    index = build_label_index(label_graphs)
+    tasks, pruned = [], 0
+    for k, pat in enumerate(patterns):
+        cands = candidate_graphs(index, normalize_pattern(pattern_graph(pat)))
+        pruned += len(label_graphs) - len(cands)
+        for j in range(0, len(cands), MATCH_TASK_GRAPHS):
+            tasks.append((k, pat, cands[j:j + MATCH_TASK_GRAPHS]))
+    if stats is not None:
+        stats.update(pairs=len(patterns) * len(label_graphs), pruned=pruned)
+
+    job_update(job, "matching", 0, len(tasks))
+    if workers <= 1 or len(tasks) <= 1:
+        for t, task in enumerate(tasks):
+            yield from _match_task(task, label_graphs)
+            job_update(job, "matching", t + 1, len(tasks))
+    else:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        # results come in task order, so the table matches a serial run
+        for t, rows in enumerate(worker_map(_match_task, tasks, label_graphs, workers, chunksize)):
+            yield from rows
+            job_update(job, "matching", t + 1, len(tasks))
+
+def pattern_automorphisms(pattern):
+    """
+    Automorphisms of a pattern as permutations of its vertex positions
+    (pattern vertices in sorted order, as in match table 'rooms').
+    """
+    P = normalize_pattern(pattern_graph(pattern))
+    verts = sorted(P)
+    pos = {v: i for i, v in enumerate(verts)}
+    matcher = GraphMatcher(P, P, node_match=lambda a, b: a['label'] == b['label'])
+    return [[pos[sigma[v]] for v in verts] for sigma in matcher.isomorphisms_iter()]
+
+def unique_placements(rows, patterns, stats=None):
+    """
+    Match table rows with one row per placement: rows of the same pattern
+    and graph whose rooms differ only by an automorphism of the pattern (a
+    symmetric chain matched from either end) are the same module, so only
+    the first is kept. Rows must come grouped by pattern, then graph, as
+    iter_match_table and enumerate_modules yield them. `stats` (optional
+    dict) is kept up to date with 'matches', 'unique' and 'skipped'.
+    """
+    if stats is None:
+        stats = {}
+    stats.update(matches=0, unique=0, skipped=0)
+    perms, group, seen = {}, None, set()
+    for row in rows:
+        k, rooms = row["pattern"], row["rooms"]
+        if k not in perms:
+            perms[k] = pattern_automorphisms(patterns[k])
+        if (k, row["gid"]) != group:
+            group, seen = (k, row["gid"]), set()
+        # the orbit of a placement is named by its smallest room ordering
+        key = min(tuple(rooms[i] for i in perm) for perm in perms[k])
+        stats["matches"] += 1
+        if key in seen:
+            stats["skipped"] += 1
+            continue
+        seen.add(key)
+        stats["unique"] += 1
+        yield row
+
+# ----------------------------------------------------------------------
+# Connected subgraph enumeration
+# ----------------------------------------------------------------------
+# Alternative to gSpan + VF2 for small modules: enumerate every connected
+# room subset once (ESU), and every connected spanning edge set on it, keyed
+# by a canonical labeled form. One pass gives supports and all matches.
+# match_pattern falls back to (induced) subgraph isomorphism, so matches are
+# the subsets whose full edge set forms the pattern.
+def esu_subsets(adj, min_k, max_k):
+    """
+    Every connected vertex subset with min_k..max_k vertices of the graph
+    with adjacency lists `adj`, each exactly once (Wernicke's ESU).
+    """
+    def extend(sub, ext, nbhd, v):
+        if len(sub) >= min_k:
+            yield sub
+        if len(sub) == max_k:
+            return
+        ext = list(ext)
+        while ext:
+            w = ext.pop()
+            # exclusive neighbours of w: not in sub and not adjacent to it
+            new = [u for u in adj[w] if u > v and u not in nbhd]
+            yield from extend(sub + (w,), ext + new, nbhd | set(adj[w]), v)
+
+    for v in range(len(adj)):
+        yield from extend((v,), [u for u in adj[v] if u > v], {v, *adj[v]}, v)
+
+def connected_edge_subsets(k, edges):
+    """Subsets of `edges` (pairs of local vertex ids) that connect all k vertices."""
+    for mask in range(1, 1 << len(edges)):
+        if bin(mask).count('1') < k - 1:
+            continue
+        parent = list(range(k))
+        def find(a):
+            while parent[a] != a:
+                a = parent[a]
+            return a
+        sel, parts = [], k
+        for i, (a, b) in enumerate(edges):
+            if mask >> i & 1:
+                sel.append((a, b))
+                ra, rb = find(a), find(b)
+                if ra != rb:
+                    parent[ra], parts = rb, parts - 1
+        if parts == 1:
+            yield sel
+
+def canonical_form(labels, edges):
+    """
+    Canonical key of a small labeled graph and every vertex order that
+    attains it, one per automorphism. Vertices are ordered by label and only
+    orders within equal labels are tried.
+    """
+    order = sorted(range(len(labels)), key=labels.__getitem__)
+    groups = [list(g) for _, g in groupby(order, key=labels.__getitem__)]
+    best, orders = None, []
+    for combo in product(*(permutations(g) for g in groups)):
+        perm = [v for g in combo for v in g]
+        pos = {v: i for i, v in enumerate(perm)}
+        code = tuple(sorted((min(pos[a], pos[b]), max(pos[a], pos[b])) for a, b in edges))
+        if best is None or code < best:
+            best, orders = code, [perm]
+        elif code == best:
+            orders.append(perm)
+    return (tuple(sorted(labels)), best), orders
+
+def _min_dfs_code(key):
+    """gSpan's minimum DFS code of the graph with canonical key `key`."""
+    labels, edges = key
+    g = GSpanGraph(0, is_undirected=True, eid_auto_increment=True)
+    for i, l in enumerate(labels):
+        g.add_vertex(i, l)
+    for a, b in edges:
+        g.add_edge(AUTO_EDGE_ID, a, b, 1)
+    gs = _MemoryGSpan({0: g}, 1, min_num_vertices=len(labels), max_num_vertices=len(labels))
+    gs.run()
+    return next(code for code, _ in gs.patterns if len(code) == len(edges))
+
+def enumerate_modules(graphs, min_sup, min_vertices=2, max_vertices=5, job=None):
+    """
+    Frequent room patterns of min..max_vertices rooms of (gid, compact graph)
+    pairs, and their match table, from a single enumeration. Patterns are the
+    dicts mine_frequent_patterns returns, ordered by DFS code; table rows are
+    the rows iter_match_table yields, one per pattern automorphism.
+    """
+    rr = [(gid, room_room_graph(C)) for gid, C in graphs]
+    vocab = sorted({l for _, (_, labels, _, _) in rr for l in labels})
+    code = {l: i for i, l in enumerate(vocab)}
+
+    # support counts every connected edge set, as gSpan's subgraph support does;
+    # the match table only induced ones, as match_pattern's isomorphism search
+    support = defaultdict(set)
+    induced = defaultdict(list)  # key -> [(gid, [rooms by canonical position, ...]), ...]
+    for gi, (gid, (nodes, labels, us, vs)) in enumerate(rr):
+        job_update(job, "enumerating", gi, len(rr))
+        vid = {n: i for i, n in enumerate(nodes)}
+        adj = [[] for _ in nodes]
+        for u, v in zip(us, vs):
+            adj[vid[u]].append(vid[v]); adj[vid[v]].append(vid[u])
+        lab = [code[l] for l in labels]
+        for sub in esu_subsets(adj, max(2, min_vertices), max_vertices):
+            local = {x: i for i, x in enumerate(sub)}
+            sub_edges = [(local[a], local[b]) for a in sub for b in adj[a] if b in local and local[a] < local[b]]
+            for es in connected_edge_subsets(len(sub), sub_edges):
+                key, orders = canonical_form([lab[x] for x in sub], es)
+                support[key].add(gid)
+                if len(es) == len(sub_edges):
+                    induced[key].append((gid, [[nodes[sub[i]] for i in o] for o in orders]))
+
+    patterns = [(_min_dfs_code(key), len(gids), key) for key, gids in support.items() if len(gids) >= min_sup]
+    patterns.sort(key=lambda p: p[0])
+
+    out, table = [], []
+    for k, (dfs, sup, key) in enumerate(patterns):
+        job_update(job, "tabulating", k, len(patterns))
+        pat = make_pattern(dfs, sup, vocab)
+        # pattern vertices in canonical order, to map occurrences onto them
+        pv = list(pat['labels'])
+        _, (ref, *_) = canonical_form([code[pat['labels'][v]] for v in pv],
+                                      [(pv.index(a), pv.index(b)) for a, b in pat['edges']])
+        for gid, orders in induced.get(key, ()):
+            for rooms in orders:
+                mapping = {r: pv[ref[i]] for i, r in enumerate(rooms)}
+                inv = {p: r for r, p in mapping.items()}
+                table.append({"pattern": k, "gid": gid, "rooms": tuple(inv[i] for i in sorted(inv)),
+                              "mapping": mapping})
+        out.append(pat)
+    return out, table
+
 # ----------------------------------------------------------------------
 # Segment enrichment
 # ----------------------------------------------------------------------
@@ -499,17 +1227,418 @@ def enrich_graph(G):
     return G
 
 # ----------------------------------------------------------------------
-# Local write helpers
+# Compact graphs
 # ----------------------------------------------------------------------
-def save_graph_pickle(gid, G):
-    path = os.path.join(GRAPH_DIR, f"{gid}.pkl")
-    with open(path, "wb") as f:
-        pickle.dump(G, f)
+# Array-backed form of an apartment graph, and the form graphs are saved in
+# (GRAPH_DIR/<gid>.npz), so that all apartments fit in memory at once for
+# mining and matching. A compact graph is a dict:
+#   gid, apartment_id   identifiers
+#   nodes               node ids (str), in networkx node order
+#   kind                int8 code into NODE_KINDS
+#   roomtypes, label    roomtype vocabulary of the graph and int16 codes into it (-1: none)
+#   indptr, indices     CSR adjacency over node positions, in networkx adjacency order
+#   etype, shared       per CSR entry: int8 code into EDGE_TYPES, shared_length (NaN: none)
+#   wkb, wkb_offsets    geometries as one WKB byte buffer; node i is wkb[off[i]:off[i+1]]
+# compact_to_networkx rebuilds the full graph where it is needed (enrichment,
+# images). Graphs saved as pickles by earlier versions are converted on load.
+NODE_KINDS = ('apartment', 'room', 'wall')
+EDGE_TYPES = ('apartment-room', 'room-room', 'room-wall', 'wall-wall')
+
+def compact_graph(G, gid=None):
+    nodes = list(G.nodes)
+    pos = {n: i for i, n in enumerate(nodes)}
+    kind = np.array([NODE_KINDS.index(d.get('type')) for d in G.nodes.values()], dtype=np.int8)
+
+    roomtypes, label = {}, np.full(len(nodes), -1, dtype=np.int16)
+    for i, d in enumerate(G.nodes.values()):
+        if 'roomtype' in d:
+            label[i] = roomtypes.setdefault(d['roomtype'], len(roomtypes))
+
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    indices, etype, shared = [], [], []
+    for i, n in enumerate(nodes):
+        for m, d in G.adj[n].items():
+            indices.append(pos[m])
+            etype.append(EDGE_TYPES.index(d['edge_type']))
+            shared.append(d.get('shared_length', np.nan))
+        indptr[i + 1] = len(indices)
+
+    blobs = [shapely.to_wkb(d['geometry']) if d.get('geometry') is not None else b''
+             for d in G.nodes.values()]
+    apt = next((d['apartment_id'] for d in G.nodes.values() if 'apartment_id' in d), '')
+    return {
+        "gid": gid, "apartment_id": str(apt),
+        "nodes": np.array(nodes, dtype=str), "kind": kind,
+        "roomtypes": np.array(list(roomtypes), dtype=str), "label": label,
+        "indptr": indptr, "indices": np.array(indices, dtype=np.int32),
+        "etype": np.array(etype, dtype=np.int8), "shared": np.array(shared, dtype=np.float64),
+        "wkb": np.frombuffer(b''.join(blobs), dtype=np.uint8),
+        "wkb_offsets": np.concatenate([[0], np.cumsum([len(b) for b in blobs])]).astype(np.int64),
+    }
 
-def load_graph_pickle(gid):
-    path = os.path.join(GRAPH_DIR, f"{gid}.pkl")
-    with open(path, "rb") as f:
-        return pickle.load(f)
+def compact_edges(C, etype=None):
+    """(u, v, CSR entry) arrays of the edges of C in networkx edge order, optionally of one EDGE_TYPES name."""
+    rows = np.repeat(np.arange(len(C['nodes'])), np.diff(C['indptr']))
+    keep = C['indices'] > rows
+    if etype is not None:
+        keep &= C['etype'] == EDGE_TYPES.index(etype)
+    entries = np.flatnonzero(keep)
+    return rows[entries], C['indices'][entries], entries
+
+def compact_geometries(C, idx):
+    """Decode the geometries of node positions `idx`."""
+    off, wkb = C['wkb_offsets'], C['wkb']
+    return [shapely.from_wkb(wkb[off[i]:off[i + 1]].tobytes()) if off[i + 1] > off[i] else None for i in idx]
+
+def compact_to_networkx(C):
+    G = nx.Graph()
+    geoms = compact_geometries(C, range(len(C['nodes'])))
+    for i, n in enumerate(C['nodes'].tolist()):
+        d = {"type": NODE_KINDS[C['kind'][i]]}
+        if C['label'][i] >= 0:
+            d['roomtype'] = str(C['roomtypes'][C['label'][i]])
+        if d['type'] in ('apartment', 'room'):
+            d['apartment_id'] = C['apartment_id']
+        if geoms[i] is not None:
+            d['geometry'] = geoms[i]
+        G.add_node(n, **d)
+    nodes = C['nodes'].tolist()
+    for u, v, e in zip(*compact_edges(C)):
+        d = {"edge_type": EDGE_TYPES[C['etype'][e]]}
+        if not np.isnan(C['shared'][e]):
+            d['shared_length'] = float(C['shared'][e])
+        G.add_edge(nodes[u], nodes[v], **d)
+    return G
+
+def saved_graph_ids():
+    """gids of the graphs in GRAPH_DIR, including pickles not converted yet."""
+    names = {os.path.splitext(f)[0] for f in os.listdir(GRAPH_DIR)
+             if f.endswith((".npz", ".pkl")) and not f.startswith(".")}
+    return sorted(names)
+
+def save_compact_graph(gid, G):
+    """Save G in compact form as GRAPH_DIR/<gid>.npz; returns the compact graph."""
+    C = compact_graph(G, gid)
+    fd, tmp = tempfile.mkstemp(dir=GRAPH_DIR, prefix=f".{gid}.", suffix=".npz")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, **{k: v for k, v in C.items() if k != 'gid'})
+    os.replace(tmp, os.path.join(GRAPH_DIR, f"{gid}.npz"))
+    return C
+
+def load_compact_graph(gid):
+    """
+    Load the compact graph of `gid`. A graph still saved as a pickle is
+    converted, and the pickle replaced by the .npz.
+    """
+    path = os.path.join(GRAPH_DIR, f"{gid}.npz")
+    pkl = os.path.join(GRAPH_DIR, f"{gid}.pkl")
+    if os.path.exists(pkl):
+        with open(pkl, "rb") as f:
+            C = save_compact_graph(gid, pickle.load(f))
+        os.remove(pkl)
+        return C
+    with np.load(path, allow_pickle=False) as z:
+        C = {k: z[k] for k in z.files}
+    C['gid'], C['apartment_id'] = gid, str(C['apartment_id'])
+    return C
+
+def load_graph(gid):
+    """The saved graph of `gid` as a networkx graph."""
+    return compact_to_networkx(load_compact_graph(gid))
+
+# ----------------------------------------------------------------------
+# Dataset sources
+# ----------------------------------------------------------------------
+# A dataset is a dict with 'floors' ({floor_id: [apartment_id, ...]}) and
+# 'digests' ({gid: content hash}). An in-memory dataset also holds the
+# frame, its geometries and partition index; a stored dataset holds the
+# path of its per-floor partitions, which are read one floor at a time.
+def apartment_digests(df, index):
+    """sha1 per gid over the row hashes of its geom/roomtype rows, in row order."""
+    row_hash = pd.util.hash_pandas_object(df[['geom', 'roomtype']], index=False).to_numpy()
+    return {
+        f"{f}_{apt}": hashlib.sha1(row_hash[index['rows'][(f, apt)]].tobytes()).hexdigest()
+        for f, apts in index['floors'].items() for apt in apts
+    }
+
+def dataset_from_frame(df):
+    index = build_partition_index(df)
+    return {
+        "kind": "memory", "rows": len(df), "floors": index['floors'],
+        "digests": apartment_digests(df, index),
+        "df": df, "geoms": parse_geometries(df), "index": index,
+    }
+
+# On-disk dataset layout (one directory per dataset under STORE_DIR):
+#   meta.json                    format tag, row count, floors/apartments, digests
+#   floor=<id>/part-NNNNN.arrow  uncompressed Arrow IPC files, geometry as WKB
+# Uncompressed IPC files can be memory-mapped and read without copying, and
+# WKB decodes much faster than WKT, so reopening a dataset only reads meta.json.
+STORE_FORMAT = "ibc-dataset/1"
+GEOM_WKB = "geom_wkb"
+
+def _floor_dir(path, fid):
+    return os.path.join(path, f"floor={fid}")
+
+EXCEL_EXTS = ('.xls', '.xlsx')
+
+def upload_ext(filename):
+    """Lower-case extension of an uploaded file name."""
+    return os.path.splitext(filename)[1].lower()
+
+def read_frames(fileobj, filename, chunksize=200_000):
+    """
+    Yield the rows of an uploaded file as DataFrames of at most `chunksize`
+    rows. CSV, Parquet and Arrow/Feather are read incrementally; pandas has
+    no chunked Excel reader, so a workbook comes back as one frame.
+    """
+    ext = upload_ext(filename)
+    if ext in EXCEL_EXTS:
+        yield pd.read_excel(fileobj, dtype={'apartment_id': str})
+    elif ext == '.parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(fileobj).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif ext in ('.arrow', '.feather', '.ipc'):
+        reader = pa.ipc.open_file(fileobj)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i).to_pandas()
+    else:
+        reader = pd.read_csv(fileobj, chunksize=chunksize, dtype={'apartment_id': str})
+        try:
+            yield from reader
+        finally:
+            reader.close()
+
+def ingest_frames(frames, name):
+    """
+    Write frames into the on-disk dataset STORE_DIR/<name>, one Arrow part
+    per floor per frame, with the WKT `geom` column (or an existing WKB
+    column) stored as WKB. Only one frame is held in memory. Apartment
+    lists and content digests are accumulated on the way.
+
+    The dataset is written to a temporary sibling directory and renamed
+    into place once complete, so a failed upload leaves an existing
+    dataset of the same name untouched.
+    """
+    final = os.path.join(STORE_DIR, name)
+    path = tempfile.mkdtemp(dir=STORE_DIR, prefix=f".{name}.")
+    try:
+        _write_store(frames, name, path)
+    except BaseException:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+    old = None
+    if os.path.exists(final):
+        old = tempfile.mkdtemp(dir=STORE_DIR, prefix=f".{name}.old.")
+        os.replace(final, old)
+    os.replace(path, final)
+    clear_floor_cache()
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+    return open_store(final)
+
+def _write_store(frames, name, path):
+    floors, digests, rows, skipped = {}, {}, 0, 0
+    for n, chunk in enumerate(frames):
+        rows += len(chunk)
+        keep = chunk.floor_id.notna()
+        skipped += int((~keep).sum())
+        chunk = chunk[keep]
+        if chunk.floor_id.dtype.kind == 'f' and (chunk.floor_id % 1 == 0).all():
+            chunk = chunk.assign(floor_id=chunk.floor_id.astype('int64'))
+        if chunk.apartment_id.dtype != object:
+            chunk = chunk.assign(apartment_id=chunk.apartment_id.astype(str).where(chunk.apartment_id.notna()))
+
+        # digests hash the geometry as uploaded, so WKT input matches in-memory uploads
+        geom_col = 'geom' if 'geom' in chunk else GEOM_WKB
+        row_hash = pd.util.hash_pandas_object(chunk[[geom_col, 'roomtype']], index=False).to_numpy()
+        for (f, apt), pos in chunk.groupby(['floor_id', 'apartment_id'], sort=False).indices.items():
+            digests.setdefault(f"{f}_{apt}", hashlib.sha1()).update(row_hash[pos].tobytes())
+        if geom_col == 'geom':
+            chunk = chunk.assign(**{GEOM_WKB: shapely.to_wkb(parse_geometries(chunk))}).drop(columns='geom')
+
+        for f, part in chunk.groupby('floor_id', sort=False):
+            f = f.item() if isinstance(f, np.generic) else f
+            apts = floors.setdefault(f, {})
+            apts.update(dict.fromkeys(part.apartment_id.dropna()))
+            os.makedirs(_floor_dir(path, f), exist_ok=True)
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            with pa.OSFile(os.path.join(_floor_dir(path, f), f"part-{n:05d}.arrow"), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+    meta = {
+        "format": STORE_FORMAT, "name": name, "rows": rows, "skipped_rows": skipped,
+        "floors": [[f, list(apts)] for f, apts in floors.items()],
+        "digests": {gid: h.hexdigest() for gid, h in digests.items()},
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+def open_store(path):
+    """Open a stored dataset; only meta.json is read."""
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("format") != STORE_FORMAT:
+        raise ValueError(f"{path} is not a {STORE_FORMAT} dataset, upload it again")
+    return {
+        "kind": "store", "path": path, "name": meta["name"], "rows": meta["rows"],
+        "floors": {f: apts for f, apts in meta["floors"]}, "digests": meta["digests"],
+    }
+
+def list_stores():
+    stores = []
+    for name in sorted(os.listdir(STORE_DIR)):
+        if name.startswith('.'):  # an upload in progress
+            continue
+        try:
+            ds = open_store(os.path.join(STORE_DIR, name))
+        except (FileNotFoundError, ValueError, json.JSONDecodeError):
+            continue
+        stores.append({"name": name, "rows": ds["rows"], "floors": len(ds["floors"]),
+                       "apartments": len(ds["digests"])})
+    return stores
+
+def read_floor_table(path, fid):
+    """Memory-map the Arrow parts of one floor (zero-copy) and concatenate them."""
+    fdir = _floor_dir(path, fid)
+    parts = sorted(os.listdir(fdir)) if os.path.isdir(fdir) else []
+    return [pa.ipc.open_file(pa.memory_map(os.path.join(fdir, p))).read_all() for p in parts]
+
+# Most recently loaded floor of a stored dataset, per process. Request and
+# job threads share it, so it is only touched under its lock.
+_FLOOR_CACHE = {}
+_FLOOR_CACHE_LOCK = threading.Lock()
+
+def clear_floor_cache():
+    with _FLOOR_CACHE_LOCK:
+        _FLOOR_CACHE.clear()
+
+def load_floor(dataset, fid):
+    """
+    Return (df, geoms, index) covering floor `fid`. In-memory datasets
+    return their full frame; stored ones read and decode only that floor.
+    """
+    if dataset["kind"] == "memory":
+        return dataset["df"], dataset["geoms"], dataset["index"]
+    key = (dataset["path"], fid)
+    with _FLOOR_CACHE_LOCK:
+        cached = _FLOOR_CACHE.get(key)
+    if cached is not None:
+        return cached
+    tables = read_floor_table(dataset["path"], fid)
+    if tables:
+        geoms = np.concatenate([shapely.from_wkb(t.column(GEOM_WKB).to_numpy(zero_copy_only=False))
+                                for t in tables])
+        df = pd.concat([t.drop([GEOM_WKB]).to_pandas() for t in tables], ignore_index=True)
+    else:
+        geoms = np.empty(0, dtype=object)
+        df = pd.DataFrame(columns=['floor_id', 'apartment_id', 'roomtype'])
+    entry = (df, geoms, build_partition_index(df))
+    with _FLOOR_CACHE_LOCK:
+        _FLOOR_CACHE.clear()
+        _FLOOR_CACHE[key] = entry
+    return entry
+
+# ----------------------------------------------------------------------
+# Parallel graph building
+# ----------------------------------------------------------------------
+# Held while graphs are built and while /mine runs, by request threads and
+# the job thread alike. Building rewrites saved_graphs/ and manifest.json;
+# mining clears and refills enrich_graph_db/, the metrics file and
+# app.state.mined_combos, which grouping reads.
+_PIPELINE_LOCK = threading.Lock()
+
+# Fingerprint of every graph last written by process_all, keyed by gid.
+GRAPH_MANIFEST = os.path.join(GRAPH_DIR, "manifest.json")
+# Bump when build_graph_for_apartment changes its output, to force a rebuild.
+GRAPH_BUILD_VERSION = 1
+
+def apartment_fingerprints(dataset, buffer_dist, min_shared_len):
+    """Per-gid content digest of the dataset combined with the build parameters."""
+    salt = repr((GRAPH_BUILD_VERSION, float(buffer_dist), float(min_shared_len))).encode()
+    return {gid: hashlib.sha1(d.encode() + salt).hexdigest() for gid, d in dataset["digests"].items()}
+
+def load_graph_manifest():
+    try:
+        with open(GRAPH_MANIFEST) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_graph_manifest(manifest):
+    tmp = GRAPH_MANIFEST + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, GRAPH_MANIFEST)
+
+# Building workers get (dataset, build parameters) as their payload. A
+# stored dataset only passes its path; workers read the floors they need.
+def _build_and_save(unit, context=None):
+    f, apt = unit
+    dataset, build_kwargs = context or _WORKER_PAYLOAD
+    df, geoms, index = load_floor(dataset, f)
+    G = build_graph_for_apartment(df, f, apt, parsed_geoms=geoms, index=index, **build_kwargs)
+    save_compact_graph(f"{f}_{apt}", G)
+    return unit
+
+def build_all_graphs(dataset, workers=1, job=None,
+                     buffer_dist=0.6, min_shared_len=0.1, incremental=True):
+    """
+    Build and save the graph of every (floor, apartment) in `dataset`,
+    serially or over a pool of `workers` processes.
+
+    With `incremental`, apartments whose fingerprint matches the manifest
+    keep their saved graph, and graphs of apartments that left the dataset
+    are deleted. Returns the {floor: [apartment, ...]} summary plus the
+    rebuilt / reused / removed counts.
+    """
+    with _PIPELINE_LOCK:
+        build_kwargs = {"buffer_dist": buffer_dist, "min_shared_len": min_shared_len}
+        units = [(f, apt) for f, apts in dataset['floors'].items() for apt in apts]
+        fingerprints = apartment_fingerprints(dataset, buffer_dist, min_shared_len)
+        manifest = load_graph_manifest()
+
+        removed = [gid for gid in manifest if gid not in fingerprints]
+        for gid in removed:
+            for ext in (".pkl", ".npz"):
+                try:
+                    os.remove(os.path.join(GRAPH_DIR, gid + ext))
+                except FileNotFoundError:
+                    pass
+            del manifest[gid]
+
+        def is_current(unit):
+            gid = f"{unit[0]}_{unit[1]}"
+            return (manifest.get(gid) == fingerprints[gid]
+                    and os.path.exists(os.path.join(GRAPH_DIR, f"{gid}.npz")))
+        todo = [u for u in units if not (incremental and is_current(u))]
+
+        written = []
+        def built(unit):
+            gid = f"{unit[0]}_{unit[1]}"
+            manifest[gid] = fingerprints[gid]
+            written.append(gid)
+            job_update(job, "building", len(written), len(todo), partial=gid)
+
+        job_update(job, "building", 0, len(todo))
+        try:
+            if workers <= 1 or len(todo) <= 1:
+                for unit in todo:
+                    built(_build_and_save(unit, (dataset, build_kwargs)))
+            else:
+                chunksize = max(1, len(todo) // (workers * 4))
+                for unit in worker_map(_build_and_save, todo, (dataset, build_kwargs), workers, chunksize):
+                    built(unit)
+        finally:
+            # record whatever was written, so a cancelled run resumes where it stopped
+            save_graph_manifest(manifest)
+
+        summary = {str(f): [] for f in dataset['floors']}
+        for f, apt in units:
+            summary[str(f)].append(str(apt))
+        return {"details": summary, "rebuilt": len(todo), "reused": len(units) - len(todo), "removed": len(removed)}
 
 # ----------------------------------------------------------------------
 # Neo4j write helpers
@@ -575,6 +1704,277 @@ def export_metrics(metrics, filename):
     df = pd.DataFrame(metrics)
     df.to_excel(filename, index=False)
 
+# /mine writes one row per match to METRICS_BASE.<parquet|csv> as it goes;
+# the Excel workbook is only built on request, from that file.
+METRICS_BASE = "pattern_metrics"
+METRICS_FORMATS = ("parquet", "csv")
+METRICS_EXCEL = METRICS_BASE + ".xlsx"
+METRICS_BATCH_ROWS = 10_000
+METRICS_SCHEMA = pa.schema([
+    ("gid", pa.string()), ("pattern", pa.string()), ("support", pa.int64()),
+    ("ratio", pa.float64()), ("width", pa.float64()), ("viol", pa.float64()),
+])
+
+class MetricsSink:
+    """
+    Append-only metrics file. Rows are buffered and flushed every
+    METRICS_BATCH_ROWS rows (one Parquet row group or one block of CSV
+    lines), so memory stays flat however many matches there are. The file
+    is written under a temporary name of its own, so concurrent runs do not
+    mix their rows, and moved into place on close(). A CSV file gets a
+    sidecar index of the byte offset of each block, so a page can seek to
+    its block instead of reading every line before it.
+    """
+    def __init__(self, fmt="parquet"):
+        self.path = f"{METRICS_BASE}.{fmt}"
+        self.fmt = fmt
+        self.rows = 0
+        fd, self._tmp = tempfile.mkstemp(prefix=self.path + ".", suffix=".part",
+                                         dir=os.path.dirname(self.path) or ".")
+        self._buf = []
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            os.close(fd)
+            self._writer = pq.ParquetWriter(self._tmp, METRICS_SCHEMA)
+        else:
+            self._file = os.fdopen(fd, "w", newline="", encoding="utf-8")
+            self._writer = csv.DictWriter(self._file, fieldnames=METRICS_SCHEMA.names)
+            self._writer.writeheader()
+            self._offsets = []
+
+    def write(self, row):
+        self._buf.append(row)
+        self.rows += 1
+        if len(self._buf) >= METRICS_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self._buf:
+            return
+        if self.fmt == "parquet":
+            self._writer.write_table(pa.Table.from_pylist(self._buf, schema=METRICS_SCHEMA))
+        else:
+            self._file.flush()
+            self._offsets.append(self._file.buffer.tell())
+            self._writer.writerows(self._buf)
+            self._file.flush()
+        self._buf = []
+
+    def close(self):
+        self.flush()
+        (self._writer if self.fmt == "parquet" else self._file).close()
+        if self.fmt == "csv":
+            index = {"rows": self.rows, "block_rows": METRICS_BATCH_ROWS, "offsets": self._offsets,
+                     "size": os.path.getsize(self._tmp)}
+            with open(self._tmp + ".idx", "w") as f:
+                json.dump(index, f)
+            os.replace(self._tmp + ".idx", self.path + ".idx")
+        # mkstemp creates the file private to its owner; publish it like any other output
+        os.chmod(self._tmp, 0o644)
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        (self._writer if self.fmt == "parquet" else self._file).close()
+        try:
+            os.remove(self._tmp)
+        except FileNotFoundError:
+            pass
+
+def clear_metrics():
+    for path in [f"{METRICS_BASE}.{fmt}" for fmt in METRICS_FORMATS] + [METRICS_EXCEL, f"{METRICS_BASE}.csv.idx"]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def current_metrics_file():
+    """The metrics file of the last /mine run, or None."""
+    paths = [p for p in (f"{METRICS_BASE}.{fmt}" for fmt in METRICS_FORMATS) if os.path.exists(p)]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+def csv_block_index(path):
+    """
+    The block index of a CSV metrics file. Rebuilt with one pass over the
+    file if the sidecar is missing or belongs to another version of it.
+    """
+    try:
+        with open(path + ".idx") as f:
+            index = json.load(f)
+        if index["size"] == os.path.getsize(path):
+            return index
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+    offsets, rows = [], 0
+    with open(path, "rb") as f:
+        f.readline()  # header
+        pos = f.tell()
+        for line in iter(f.readline, b""):
+            if rows % METRICS_BATCH_ROWS == 0:
+                offsets.append(pos)
+            rows += 1
+            pos += len(line)
+        size = pos
+    return {"rows": rows, "block_rows": METRICS_BATCH_ROWS, "offsets": offsets, "size": size}
+
+def read_metrics_page(path, offset, limit):
+    """
+    Rows offset..offset+limit of a metrics file and the total row count.
+    Parquet reads only the row groups that overlap the page; CSV seeks to
+    the block holding `offset` through the index MetricsSink wrote.
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(path)
+        total = pf.metadata.num_rows
+        groups, start, first = [], 0, None
+        for i in range(pf.num_row_groups):
+            n = pf.metadata.row_group(i).num_rows
+            if start + n > offset and start < offset + limit:
+                groups.append(i)
+                first = start if first is None else first
+            start += n
+        if not groups:
+            return [], total
+        table = pf.read_row_groups(groups).slice(offset - first, limit)
+        return table.to_pylist(), total
+    index = csv_block_index(path)
+    total = index["rows"]
+    block = offset // index["block_rows"]
+    if block >= len(index["offsets"]):
+        return [], total
+    with open(path, "rb") as f:
+        f.seek(index["offsets"][block])
+        df = pd.read_csv(f, header=None, names=METRICS_SCHEMA.names, skiprows=offset - block * index["block_rows"],
+                         nrows=limit, dtype={"gid": str}, encoding="utf-8", float_precision="round_trip")
+    return df.to_dict(orient="records"), total
+
+def write_metrics_excel(job=None):
+    """Convert the current metrics file to METRICS_EXCEL, batch by batch."""
+    path = current_metrics_file()
+    if path is None:
+        raise HTTPException(404, "No metrics yet; run /mine first.")
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(path)
+        total = pf.metadata.num_rows
+        batches = (b.to_pandas() for b in pf.iter_batches(batch_size=METRICS_BATCH_ROWS))
+    else:
+        total = None
+        batches = pd.read_csv(path, chunksize=METRICS_BATCH_ROWS, dtype={"gid": str})
+    # a temporary name of its own (ending in .xlsx, which openpyxl goes by) per export
+    fd, tmp = tempfile.mkstemp(prefix=METRICS_EXCEL + ".", suffix=".part.xlsx", dir=".")
+    os.close(fd)
+    done = 0
+    try:
+        with pd.ExcelWriter(tmp, engine="openpyxl") as writer:
+            pd.DataFrame(columns=METRICS_SCHEMA.names).to_excel(writer, index=False)
+            for df in batches:
+                df.to_excel(writer, index=False, header=False, startrow=done + 1)
+                done += len(df)
+                job_update(job, "writing excel", done, total)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, METRICS_EXCEL)
+    return {"metrics": METRICS_EXCEL, "rows": done}
+
+# ----------------------------------------------------------------------
+# Background jobs
+# ----------------------------------------------------------------------
+# Jobs share on-disk state (saved_graphs/, enrich_graph_db/, the metrics
+# file), so they run one at a time on a single worker thread.
+JOBS = {}
+_JOBS_LOCK = threading.Lock()
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job")
+# Finished jobs kept for polling; older ones are dropped as new jobs arrive.
+JOBS_KEEP_FINISHED = 50
+
+class JobCancelled(Exception):
+    pass
+
+def job_update(job, stage=None, done=None, total=None, partial=None, reset=True):
+    """
+    Report progress on `job` (a no-op when it is None) and raise
+    JobCancelled if cancellation was requested. A new stage starts its
+    progress from zero, unless `reset` is False: then the stage only
+    relabels work that counts towards the current done/total.
+    """
+    if job is None:
+        return
+    if job["cancel"].is_set():
+        raise JobCancelled()
+    with _JOBS_LOCK:
+        if stage is not None and stage != job["stage"]:
+            job["stage"] = stage
+            if reset:
+                job["done"], job["total"] = 0, None
+        if done is not None:
+            job["done"] = done
+        if total is not None:
+            job["total"] = total
+        if partial is not None:
+            job["partial"].append(partial)
+
+def _run_job(job, fn, kwargs):
+    with _JOBS_LOCK:
+        if job["cancel"].is_set():
+            job["status"], job["finished"] = "cancelled", time.time()
+            return
+        job["status"], job["started"] = "running", time.time()
+    try:
+        result = fn(job=job, **kwargs)
+    except JobCancelled:
+        status, result, error = "cancelled", None, None
+    except HTTPException as e:
+        status, result, error = "failed", None, e.detail
+    except Exception as e:
+        status, result, error = "failed", None, f"{type(e).__name__}: {e}"
+    else:
+        status, error = "done", None
+    with _JOBS_LOCK:
+        job.update(status=status, result=result, error=error, finished=time.time())
+
+def submit_job(kind, fn, **kwargs):
+    job = {
+        "id": uuid.uuid4().hex, "kind": kind, "params": kwargs,
+        "status": "queued", "stage": None, "done": 0, "total": None,
+        "partial": [], "result": None, "error": None,
+        "created": time.time(), "started": None, "finished": None,
+        "cancel": threading.Event(),
+    }
+    with _JOBS_LOCK:
+        finished = sorted((j for j in JOBS.values() if j["finished"] is not None), key=lambda j: j["finished"])
+        for old in finished[:max(0, len(finished) - JOBS_KEEP_FINISHED + 1)]:
+            del JOBS[old["id"]]
+        JOBS[job["id"]] = job
+    JOB_EXECUTOR.submit(_run_job, job, fn, kwargs)
+    return job
+
+def job_view(job, partial_from=0):
+    with _JOBS_LOCK:
+        total = job["total"]
+        percent = round(100.0 * job["done"] / total, 1) if total else None
+        if job["status"] == "done":
+            percent = 100.0
+        result = job["result"]
+        if job["kind"] == "mine" and result is not None:
+            # a mine job keeps its entries once, as partial results
+            result = {"message": result["message"], "patterns": job["partial"],
+                      **{k: v for k, v in result.items() if k != "message"}}
+        return {
+            "id": job["id"], "kind": job["kind"], "params": job["params"],
+            "status": job["status"], "stage": job["stage"],
+            "done": job["done"], "total": total, "percent": percent,
+            "partial": job["partial"][partial_from:],
+            "partial_count": len(job["partial"]),
+            "result": result, "error": job["error"],
+            "created": job["created"], "started": job["started"], "finished": job["finished"],
+        }
+
 # ----------------------------------------------------------------------
 # API endpoints
 # ----------------------------------------------------------------------
@@ -607,47 +2007,82 @@ def status():
 #                 proc.append(str(apt))
 #             summary[str(f)]=proc
 #     return {"message":"Processed all floors","details":summary}
-@app.post("/process_all")
-def process_all():
-    if not hasattr(app.state, 'df'):
+def _use_dataset(name=None):
+    """Open the stored dataset `name`, if given, as the current dataset."""
+    if name is not None:
+        path = os.path.join(STORE_DIR, os.path.basename(name))
+        try:
+            app.state.dataset = open_store(path)
+        except FileNotFoundError:
+            raise HTTPException(404, f"No stored dataset '{name}'")
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+    if not hasattr(app.state, 'dataset'):
         raise HTTPException(400, "Upload first.")
-    df = app.state.df
-    summary = {}
-
-    for f in df.floor_id.dropna().unique():
-        apts = df[df.floor_id == f].apartment_id.dropna().unique()
-        proc = []
-        for apt in apts:
-            G = build_graph_for_apartment(df, f, apt)
-            gid = f"{f}_{apt}"
-            save_graph_pickle(gid, G)
-            proc.append(str(apt))
-        summary[str(f)] = proc
+    return app.state.dataset
 
-    return {"message": "Processed all floors", "details": summary}
+@app.post("/process_all")
+def process_all(
+    workers:        int   = Query(1, ge=1, description="Number of worker processes"),
+    buffer_dist:    float = Query(0.6, gt=0),
+    min_shared_len: float = Query(0.1),
+    incremental:    bool  = Query(True, description="Only rebuild apartments whose content or parameters changed"),
+    dataset:        str   = Query(None, description="Open this stored dataset instead of the last upload"),
+):
+    ds = _use_dataset(dataset)
+    result = build_all_graphs(ds, workers=workers,
+                              buffer_dist=buffer_dist, min_shared_len=min_shared_len, incremental=incremental)
+    return {"message": "Processed all floors", **result}
 
 @app.post("/upload/")
-async def upload_dataset(file:UploadFile=File(...)):
-    content=await file.read()
+async def upload_dataset(
+    file: UploadFile = File(...),
+    in_memory: bool = Query(False, description="Keep the dataset in memory only; it is lost on restart"),
+    chunksize: int = Query(200_000, ge=1),
+):
+    if in_memory:
+        content=await file.read()
+        try:
+            # same readers and dtypes as the stored path, so graph ids agree
+            df=pd.concat(read_frames(io.BytesIO(content), file.filename, chunksize), ignore_index=True)
+            dataset=dataset_from_frame(df)
+        except Exception as e:
+            raise HTTPException(400,f"Parse error: {e}")
+        app.state.dataset=dataset
+        return {"message":"Dataset loaded","rows":len(df)}
+
+    name = re.sub(r'[^\w.-]+', '_', os.path.splitext(os.path.basename(file.filename))[0]) or "dataset"
+    frames = read_frames(file.file, file.filename, chunksize)
     try:
-        df=pd.read_excel(io.BytesIO(content)) if file.filename.endswith(('.xls','.xlsx')) \
-           else pd.read_csv(io.BytesIO(content))
+        dataset = await run_in_threadpool(lambda: ingest_frames(frames, name))
     except Exception as e:
         raise HTTPException(400,f"Parse error: {e}")
-    app.state.df=df
-    return {"message":"Dataset loaded","rows":len(df)}
+    finally:
+        # release the reader while the upload is still open
+        frames.close()
+    app.state.dataset=dataset
+    return {"message":"Dataset stored","rows":dataset["rows"],"dataset":dataset["name"],"floors":len(dataset["floors"])}
+
+@app.get("/datasets")
+def list_datasets():
+    return list_stores()
+
+@app.post("/datasets/{name}/open")
+def open_dataset(name: str):
+    ds = _use_dataset(name)
+    return {"message": "Dataset opened", "dataset": ds["name"], "rows": ds["rows"], "floors": len(ds["floors"])}
 
 @app.post("/process_all")
 def process_all():
-    if not hasattr(app.state,'df'): raise HTTPException(400,"Upload first.")
-    df=app.state.df; summary={}
+    if not hasattr(app.state,'dataset'): raise HTTPException(400,"Upload first.")
+    summary={}
     with driver.session() as session:
         session.run("MATCH (n) DETACH DELETE n")
-        for f in df.floor_id.dropna().unique():
-            apts=df[df.floor_id==f].apartment_id.dropna().unique()
+        for f,apts in app.state.dataset['floors'].items():
+            df,geoms,index=load_floor(app.state.dataset,f)
             proc=[]
             for apt in apts:
-                G=build_graph_for_apartment(df,f,apt)
+                G=build_graph_for_apartment(df,f,apt,parsed_geoms=geoms,index=index)
                 session.write_transaction(_save_graph_tx,G)
                 proc.append(str(apt))
             summary[str(f)]=proc
@@ -662,11 +2097,17 @@ def process_all():
 #     return {"message":f"Saved graph for floor={floor_id}, apt={apartment_id}"}
 @app.post("/process/{floor_id}/{apartment_id}")
 def process_apartment(floor_id: int, apartment_id: str):
-    if not hasattr(app.state, 'df'):
+    if not hasattr(app.state, 'dataset'):
         raise HTTPException(400, "Upload first.")
-    G = build_graph_for_apartment(app.state.df, floor_id, apartment_id)
+    df, geoms, index = load_floor(app.state.dataset, floor_id)
+    G = build_graph_for_apartment(df, floor_id, apartment_id, parsed_geoms=geoms, index=index)
     gid = f"{floor_id}_{apartment_id}"
-    save_graph_pickle(gid, G)
+    with _PIPELINE_LOCK:
+        save_compact_graph(gid, G)
+        # this graph no longer matches what process_all fingerprinted
+        manifest = load_graph_manifest()
+        if manifest.pop(gid, None) is not None:
+            save_graph_manifest(manifest)
     return {"message": f"Saved graph for floor={floor_id}, apt={apartment_id}"}
 
 @app.post("/clear_db")
@@ -683,7 +2124,7 @@ def pattern_image(gid: str, request: Request):
 
     # with driver.session() as session:
     #     G = _load_graph(session, gid)
-    G = load_graph_pickle(gid)
+    G = load_graph(gid)
 
     # Get only room nodes (matched pattern) and their adjacent walls
     matched_rooms = [n for n, d in G.nodes(data=True)
@@ -748,74 +2189,180 @@ def pattern_image(gid: str, request: Request):
 from collections import defaultdict
 
 # Add to /mine endpoint after enrichment
-import uuid
-
-@app.post("/mine")
-def mine_patterns(
-    min_support:     int   = Query(..., ge=1),
-    max_width:       float = Query(..., gt=0),
-    ratio_threshold: float = Query(..., ge=0, le=1),
-    vcount:          int   = Query(..., ge=1),
-):
-    # — clear out any old enriched pickles —
-    for fname in os.listdir(ENRICH_DIR):
-        path = os.path.join(ENRICH_DIR, fname)
-        if os.path.isfile(path):
-            os.remove(path)
-
-    # — load all graphs from disk —
-    graphs = []
-    for fname in sorted(os.listdir(GRAPH_DIR)):
-        if not fname.endswith(".pkl"):
-            continue
-        gid = fname[:-4]
-        with open(os.path.join(GRAPH_DIR, fname), "rb") as f:
-            G = pickle.load(f)
-        graphs.append((gid, G))
-
-    # — run gSpan mining —
-    export_gspan_input(graphs, GSPAN_INPUT)
-    raw = run_mining(GSPAN_INPUT, min_support)
-
-    filtered = []
-    metrics  = []
-
-    # 1) compute raw_match_graphs per pattern
-    raw_counts = {}
-    for desc,sup in raw:
-        P = parse_pattern(desc)
-        if P.number_of_nodes()!=vcount: 
-            continue
-        # count how many graphs have ≥1 subgraph match (before any filtering)
-        cnt = 0
-        for gid,G in graphs:
-            if any(find_matches(G,P)):
-                cnt += 1
-        raw_counts[desc] = cnt
-
-    # — for each raw pattern and each match, collect metrics & filter —
-    for desc, sup in raw:
-        P = parse_pattern(desc)
-        if P.number_of_nodes() != vcount:
-            continue
 
-        for gid, G in graphs:
-            for match in find_matches(G, P):
-                inv   = {pid: gn for gn, pid in match.items()}
-                rooms = [inv[i] for i in sorted(inv)]
-                polys = [G.nodes[r]["geometry"] for r in rooms]
-
-                viol, ratio, hausd, rect = compute_shape_violation(polys, ratio_threshold)
-                short_side, long_side     = compute_rect_dimensions(rect)
+def enrich_match(fullG, desc, gid, sup, rooms):
+    """Enrich and pickle the neighbourhood of a matched room set of `fullG`; returns its /mine entry."""
+    relevant = set(rooms)
+    for r in rooms:
+        relevant.update(fullG.neighbors(r))
+    subG = fullG.subgraph(relevant).copy()
+    enG  = enrich_graph(subG)
+    for r in rooms:
+        enG.nodes[r]["matched"] = True
+
+    # 2. Identify only the matched rooms
+    matched_rooms = [n for n, d in enG.nodes(data=True) if d.get("matched")]
+
+    # 3. Collect adjacent segment nodes
+    seg_nodes = {
+        nbr
+        for room in matched_rooms
+        for nbr in enG.neighbors(room)
+        if enG.nodes[nbr].get("type") == "segment"
+    }
 
-                # record _every_ match in the metrics list
-                metrics.append({
+    # 4. Build the segment‐only subgraph H
+    H = nx.Graph()
+    for seg in seg_nodes:
+        H.add_node(seg, segment_type=enG.nodes[seg]["segment_type"])
+    for u, v, data in enG.edges(data=True):
+        if u in seg_nodes and v in seg_nodes and data.get("edge_type") in {"adjacent", "double_segment"}:
+            H.add_edge(u, v)
+
+    # 5. WL‐hash H on its node_attr
+    module_hash = nx.weisfeiler_lehman_graph_hash(H, node_attr="segment_type")
+
+    uid   = str(uuid.uuid4())
+    fname = f"{gid}_{uid}.pkl"
+    with open(os.path.join(ENRICH_DIR, fname), "wb") as f:
+        pickle.dump(enG, f)
+    combo = '+'.join(sorted(fullG.nodes[r]["roomtype"] for r in rooms))
+    return {"pattern": desc, "gid": gid, "support": sup, "rooms": rooms, "combo": combo, "file": fname, "hash": module_hash,  }
+
+# Matches are shape-scored in batches of up to this many rows of one pattern.
+SCORE_BATCH_ROWS = 5000
+
+def iter_scored_matches(rows, graph_by_gid, threshold):
+    """
+    Match table rows with their room polygons and shape scores, as
+    (row, polys, viol, ratio, width). Rows of the same pattern are scored
+    together by score_shape_violations, SCORE_BATCH_ROWS at a time, and
+    come out in their original order.
+    """
+    for _, group in groupby(rows, key=lambda row: row["pattern"]):
+        while batch := list(islice(group, SCORE_BATCH_ROWS)):
+            polys = [compact_geometries(graph_by_gid[row["gid"]], list(row["rooms"])) for row in batch]
+            viol, ratio, _, width = score_shape_violations(polys, threshold)
+            yield from zip(batch, polys, viol.tolist(), ratio.tolist(), width.tolist())
+
+def counted_rows(rows, job, stage):
+    """Yield a list of match rows, reporting each one on `job` as progress."""
+    for k, row in enumerate(rows):
+        job_update(job, stage, k + 1, len(rows))
+        yield row
+
+def iter_mine(min_support, max_width, ratio_threshold, vcount, use_cache=True, max_vcount=None,
+              workers=1, engine="gspan", shards=1, top_k=None, time_budget=None, metrics_format="parquet",
+              job=None):
+    """
+    Mine frequent room patterns of `vcount` rooms (or vcount..max_vcount
+    rooms), filter their matches geometrically, then enrich and pickle the
+    survivors. Yields ("module", entry) for each survivor as soon as it is
+    enriched, then ("summary", {...}) once the metrics file is complete.
+    Matches that differ only by an automorphism of their pattern are scored
+    once. Metrics of every placement are written as they are computed, to
+    pattern_metrics.<metrics_format> (parquet or csv).
+    Raw patterns come from the mining cache when the saved graphs and
+    parameters are unchanged. top_k keeps the k most frequent patterns;
+    time_budget (gspan engine, no shards) bounds mining time and marks the
+    summary partial when it runs out. `job` (optional) receives stage and
+    progress updates and is polled for cancellation.
+    """
+    with _PIPELINE_LOCK:
+        # — clear out any old enriched pickles —
+        for fname in os.listdir(ENRICH_DIR):
+            path = os.path.join(ENRICH_DIR, fname)
+            if os.path.isfile(path):
+                os.remove(path)
+
+        # — load all graphs from disk, in compact form —
+        gids = saved_graph_ids()
+        graphs = []
+        for k, gid in enumerate(gids):
+            graphs.append((gid, load_compact_graph(gid)))
+            job_update(job, "loading", k + 1, len(gids))
+
+        # — mine patterns, unless this graph set was mined with these parameters —
+        job_update(job, "mining")
+        max_vcount = max(vcount, max_vcount or vcount)
+        cache_key = mining_cache_key(graph_set_digest([g for g, _ in graphs]), format=MINE_CACHE_FORMAT,
+                                     engine=engine, shards=shards,
+                                     min_support=min_support, min_vertices=vcount, max_vertices=max_vcount,
+                                     top_k=top_k)
+        cached = mining_cache_get(cache_key) if use_cache else None
+        cache_hit = cached is not None
+        mine_status = {"partial": False, "min_support": min_support}
+        if cache_hit:
+            mine_status["min_support"] = cached["min_support"]
+        if engine == "esu":
+            # one enumeration yields the patterns and all their matches
+            if not cache_hit:
+                patterns, rows = enumerate_modules(graphs, min_support, vcount, max_vcount, job)
+                if top_k:
+                    keep = top_k_patterns(patterns, top_k)
+                    renum = {old: new for new, old in enumerate(keep)}
+                    patterns = [patterns[i] for i in keep]
+                    rows = [dict(row, pattern=renum[row["pattern"]]) for row in rows if row["pattern"] in renum]
+                    mine_status["min_support"] = top_k_min_support(patterns, top_k, min_support)
+                cached = {"patterns": patterns, "rows": rows, "min_support": mine_status["min_support"]}
+                mining_cache_put(cache_key, cached)
+            patterns, rows = cached["patterns"], cached["rows"]
+            rows = counted_rows(rows, job, "scoring")
+            match_stats = None
+        else:
+            raw = cached and cached["patterns"]
+            if not cache_hit and shards > 1:
+                raw = mine_partitioned(graphs, min_support, min_vertices=vcount, max_vertices=max_vcount,
+                                       shards=shards, workers=workers, job=job)
+                if top_k:
+                    raw = [raw[i] for i in top_k_patterns(raw, top_k)]
+                    mine_status["min_support"] = top_k_min_support(raw, top_k, min_support)
+                mining_cache_put(cache_key, {"patterns": raw, "min_support": mine_status["min_support"]})
+            elif not cache_hit:
+                raw = mine_frequent_patterns(graphs, min_support, min_vertices=vcount, max_vertices=max_vcount,
+                                             top_k=top_k, time_budget=time_budget, status=mine_status)
+                # a run cut short by its time budget is not the answer for these parameters
+                if not mine_status["partial"]:
+                    mining_cache_put(cache_key, {"patterns": raw, "min_support": mine_status["min_support"]})
+
+            # — one matching pass over the patterns of the requested size, row by row —
+            patterns = [pat for pat in raw if vcount <= pat["num_vert"] <= max_vcount]
+            match_stats = {}
+            rows = iter_match_table(patterns, graphs, job, workers=workers, stats=match_stats)
+
+        # — each placement once, however many automorphisms the pattern has —
+        placements = {}
+        rows = unique_placements(rows, patterns, placements)
+
+        # — for each match, write its metrics, filter, and enrich the survivors —
+        raw_counts = Counter()  # graphs with ≥1 subgraph match (before any filtering)
+        counted = set()
+        # entries are handed on as they are made; only counts are kept
+        combos = Counter()      # (pattern, gid, sorted roomtypes) of enriched modules, for /pattern/combos/
+        scored = enriched = 0
+        graph_by_gid = dict(graphs)
+        fullG, full_gid = None, None
+        sink = MetricsSink(metrics_format)
+        try:
+            for row, polys, viol, ratio, short_side in iter_scored_matches(rows, graph_by_gid, ratio_threshold):
+                pat, gid = patterns[row["pattern"]], row["gid"]
+                desc, sup = pat["description"], pat["support"]
+                if (row["pattern"], gid) not in counted:
+                    counted.add((row["pattern"], gid))
+                    raw_counts[desc] += 1
+                rooms = graph_by_gid[gid]["nodes"][list(row["rooms"])].tolist()
+                scored += 1
+                # progress counts matching tasks (gspan) or enumerated rows (esu), not these stages
+                job_update(job, "filtering", reset=False)
+
+                # record _every_ match in the metrics file
+                sink.write({
                     "gid":     gid,
                     "pattern": desc,
                     "support": sup,
-                    "ratio":   ratio,
-                    "width":   short_side,
-                    "viol":    viol,
+                    "ratio":   float(ratio),
+                    "width":   float(short_side),
+                    "viol":    float(viol),
                 })
 
                 # only keep those that pass all geometric filters
@@ -825,66 +2372,119 @@ def mine_patterns(
                     and ratio <= ratio_threshold
                     and is_valid_no_partial_cross(polys)
                 ):
-                    filtered.append((gid, sup, rooms))
+                    if gid != full_gid:
+                        fullG, full_gid = compact_to_networkx(graph_by_gid[gid]), gid
+                    entry = enrich_match(fullG, desc, gid, sup, rooms)
+                    enriched += 1
+                    combos[desc, gid, tuple(sorted(fullG.nodes[r]["roomtype"] for r in rooms))] += 1
+                    job_update(job, "enriching", partial=entry, reset=False)
+                    yield "module", entry
+        except BaseException:
+            # cancelled, failed or abandoned by the client: leave no half-written file
+            sink.abort()
+            raise
+
+        job_update(job, "writing metrics")
+        clear_metrics()  # including the workbook and a file of the other format
+        sink.close()
+
+        app.state.mined_combos = combos
+        yield "summary", {
+            "message":  f"Enriched {enriched} subgraphs",
+            "metrics":  sink.path,
+            "metrics_rows": sink.rows,
+            "raw_counts": dict(raw_counts),
+            "candidates": match_stats,
+            "placements": placements,  # 'skipped' matches needed no geometry
+            "mining_cache": "hit" if cache_hit else "miss",
+            "partial": mine_status["partial"],
+            "effective_min_support": mine_status["min_support"],
+        }
 
-    # — WRITE METRICS TO EXCEL — overwrite existing file
-    if metrics:
-        df = pd.DataFrame(metrics)
-        df.to_excel("pattern_metrics.xlsx", index=False)
-    else:
-        # no metrics → remove any old file
-        try:
-            os.remove("pattern_metrics.xlsx")
-        except FileNotFoundError:
-            pass
+def check_mine_params(engine, shards, time_budget, workers=1):
+    """Reject parameter combinations iter_mine cannot honour, before any work starts."""
+    if engine == "esu" and (shards > 1 or workers > 1):
+        raise HTTPException(400, "shards and workers are only supported with engine=gspan")
+    if time_budget is not None and (engine != "gspan" or shards > 1):
+        raise HTTPException(400, "time_budget is only supported with engine=gspan and shards=1")
 
-    # — enrich & pickle the surviving subgraphs —
+class MineParams:
+    """
+    Query parameters of /mine, /mine/stream and /jobs/mine, checked with
+    check_mine_params. vars() of an instance are iter_mine's keyword arguments.
+    """
+    def __init__(
+        self,
+        min_support:     int   = Query(..., ge=1),
+        max_width:       float = Query(..., gt=0),
+        ratio_threshold: float = Query(..., ge=0, le=1),
+        vcount:          int   = Query(..., ge=1),
+        use_cache:       bool  = Query(True, description="Reuse raw patterns mined earlier from the same graphs"),
+        max_vcount:      int   = Query(None, ge=1, description="Mine vcount..max_vcount rooms instead of exactly vcount"),
+        workers:         int   = Query(1, ge=1, description="gspan only: number of matching processes"),
+        engine:          str   = Query("gspan", pattern="^(gspan|esu)$",
+                                       description="gspan: gSpan then VF2 matching; esu: enumerate connected room subsets"),
+        shards:          int   = Query(1, ge=1, description="gspan only: mine this many partitions, then verify support"),
+        top_k:           int   = Query(None, ge=1, description="Keep only the k most frequent patterns"),
+        time_budget:     float = Query(None, gt=0, description="gspan without shards: stop mining after this many seconds"),
+        metrics_format:  str   = Query("parquet", pattern="^(parquet|csv)$", description="File format of the match metrics"),
+    ):
+        check_mine_params(engine, shards, time_budget, workers)
+        self.min_support, self.max_width, self.ratio_threshold, self.vcount = min_support, max_width, ratio_threshold, vcount
+        self.use_cache, self.max_vcount, self.workers, self.engine = use_cache, max_vcount, workers, engine
+        self.shards, self.top_k, self.time_budget, self.metrics_format = shards, top_k, time_budget, metrics_format
+
+def mine_and_enrich(**kwargs):
+    """iter_mine run to completion: the summary plus every enriched entry under 'patterns'."""
     enriched = []
-    for gid, sup, rooms in filtered:
-        fullG = next(G for g, G in graphs if g == gid)
-        relevant = set(rooms)
-        for r in rooms:
-            relevant.update(fullG.neighbors(r))
-        subG = fullG.subgraph(relevant).copy()
-        enG  = enrich_graph(subG)
-        for r in rooms:
-            enG.nodes[r]["matched"] = True
-        
-        # 2. Identify only the matched rooms
-        matched_rooms = [n for n, d in enG.nodes(data=True) if d.get("matched")]
-
-        # 3. Collect adjacent segment nodes
-        seg_nodes = {
-            nbr
-            for room in matched_rooms
-            for nbr in enG.neighbors(room)
-            if enG.nodes[nbr].get("type") == "segment"
-        }
+    for kind, payload in iter_mine(**kwargs):
+        if kind == "module":
+            enriched.append(payload)
+        else:
+            summary = payload
+    return {"message": summary.pop("message"), "patterns": enriched, **summary}
 
-        # 4. Build the segment‐only subgraph H
-        H = nx.Graph()
-        for seg in seg_nodes:
-            H.add_node(seg, segment_type=enG.nodes[seg]["segment_type"])
-        for u, v, data in enG.edges(data=True):
-            if u in seg_nodes and v in seg_nodes and data.get("edge_type") in {"adjacent", "double_segment"}:
-                H.add_edge(u, v)
-
-        # 5. WL‐hash H on its node_attr
-        module_hash = nx.weisfeiler_lehman_graph_hash(H, node_attr="segment_type")
-
-        uid   = str(uuid.uuid4())
-        fname = f"{gid}_{uid}.pkl"
-        with open(os.path.join(ENRICH_DIR, fname), "wb") as f:
-            pickle.dump(enG, f)
-        combo = '+'.join(sorted(fullG.nodes[r]["roomtype"] for r in rooms))
-        enriched.append({"pattern": desc, "gid": gid, "support": sup, "rooms": rooms, "combo": combo, "file": fname, "hash": module_hash,  })
-
-    app.state.mined_patterns = enriched
-    return {
-        "message":  f"Enriched {len(enriched)} subgraphs",
-        "patterns": enriched,
-        "metrics":  "pattern_metrics.xlsx"
-    }
+@app.post("/mine")
+def mine_patterns(params: MineParams = Depends()):
+    return mine_and_enrich(**vars(params))
+
+@app.post("/mine/stream")
+def mine_patterns_stream(
+    params: MineParams = Depends(),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+):
+    """
+    /mine as a stream: one record per enriched module as soon as it is
+    pickled, then a final record of type 'summary'. NDJSON lines, or
+    server-sent events named 'module' and 'summary'.
+    """
+    events = iter_mine(**vars(params))
+    def body():
+        for kind, payload in events:
+            if format == "sse":
+                yield f"event: {kind}\ndata: {json.dumps(payload)}\n\n"
+            else:
+                yield json.dumps({"type": kind, **payload}) + "\n"
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type)
+
+@app.get("/metrics/matches")
+def metrics_matches(offset: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=100_000)):
+    """One page of the per-match metrics of the last /mine run."""
+    path = current_metrics_file()
+    if path is None:
+        raise HTTPException(404, "No metrics yet; run /mine first.")
+    rows, total = read_metrics_page(path, offset, limit)
+    return {"total": total, "offset": offset, "limit": limit, "rows": rows}
+
+@app.get("/metrics/excel")
+def metrics_excel():
+    """The workbook built by POST /jobs/metrics/excel, if it is up to date."""
+    path = current_metrics_file()
+    if (path is None or not os.path.exists(METRICS_EXCEL)
+            or os.path.getmtime(METRICS_EXCEL) < os.path.getmtime(path)):
+        raise HTTPException(404, "No current Excel export; start one with POST /jobs/metrics/excel.")
+    return FileResponse(METRICS_EXCEL, filename=METRICS_EXCEL)
 
 # @app.post("/mine")
 # def mine_patterns(
@@ -1033,70 +2633,79 @@ def mine_patterns(
 #     print(f"[grouped] total distinct groups: {len(groups)}")
 #     return {"groups": groups, "sizes": sizes}
 
-@app.get("/segments/grouped")
-def group_segment_patterns():
-    INPUT_DIR = "enrich_graph_db"
-    label_to_files = defaultdict(list)
+def group_segments(job=None):
+    """
+    Group the enriched module pickles by the WL-hash of their segment graph.
+    `job` (optional) receives progress updates and is polled for cancellation.
+    """
+    with _PIPELINE_LOCK:
+        INPUT_DIR = "enrich_graph_db"
+        label_to_files = defaultdict(list)
 
-    for fname in sorted(os.listdir(INPUT_DIR)):
-        if not fname.endswith(".pkl"):
-            continue
+        fnames = [f for f in sorted(os.listdir(INPUT_DIR)) if f.endswith(".pkl")]
+        for k, fname in enumerate(fnames):
+            job_update(job, "grouping", k, len(fnames))
 
-        path = os.path.join(INPUT_DIR, fname)
-        with open(path, "rb") as f:
-            G = pickle.load(f)
+            path = os.path.join(INPUT_DIR, fname)
+            with open(path, "rb") as f:
+                G = pickle.load(f)
 
-        # 1. Identify matched rooms
-        matched_rooms = [n for n, d in G.nodes(data=True) if d.get("matched")]
-        if not matched_rooms:
-            print(f"[grouped] {fname}: no matched rooms → skipping")
-            continue
+            # 1. Identify matched rooms
+            matched_rooms = [n for n, d in G.nodes(data=True) if d.get("matched")]
+            if not matched_rooms:
+                print(f"[grouped] {fname}: no matched rooms → skipping")
+                continue
 
-        # 2. Collect adjacent segment nodes
-        seg_nodes = {
-            nbr
-            for room in matched_rooms
-            for nbr in G.neighbors(room)
-            if G.nodes[nbr].get("type") == "segment"
-        }
-        if not seg_nodes:
-            print(f"[grouped] {fname}: no segments in mined subgraph → skipping")
-            continue
+            # 2. Collect adjacent segment nodes
+            seg_nodes = {
+                nbr
+                for room in matched_rooms
+                for nbr in G.neighbors(room)
+                if G.nodes[nbr].get("type") == "segment"
+            }
+            if not seg_nodes:
+                print(f"[grouped] {fname}: no segments in mined subgraph → skipping")
+                continue
 
-        # 3. Construct subgraph H of segments with type attribute
-        H = nx.Graph()
-        for seg in seg_nodes:
-            H.add_node(seg, segment_type=G.nodes[seg]["segment_type"])
+            # 3. Construct subgraph H of segments with type attribute
+            H = nx.Graph()
+            for seg in seg_nodes:
+                H.add_node(seg, segment_type=G.nodes[seg]["segment_type"])
 
-        # 4. Add unlabelled edges between segments (ignore edge_type)
-        for u, v, data in G.edges(data=True):
-            if u in seg_nodes and v in seg_nodes and data.get("edge_type") in {"adjacent", "double_segment"}:
-                H.add_edge(u, v)
+            # 4. Add unlabelled edges between segments (ignore edge_type)
+            for u, v, data in G.edges(data=True):
+                if u in seg_nodes and v in seg_nodes and data.get("edge_type") in {"adjacent", "double_segment"}:
+                    H.add_edge(u, v)
 
-        # 5. WL-hash using segment_type only
-        label = nx.weisfeiler_lehman_graph_hash(H, node_attr="segment_type")
-        print(f"[grouped] {fname} → WL-hash: {label}")
-        label_to_files[label].append(fname)
+            # 5. WL-hash using segment_type only
+            label = nx.weisfeiler_lehman_graph_hash(H, node_attr="segment_type")
+            print(f"[grouped] {fname} → WL-hash: {label}")
+            label_to_files[label].append(fname)
 
-    # 6. Final result
-    groups = list(label_to_files.values())
-    sizes = [len(g) for g in groups]
-    print(f"[grouped] total distinct groups: {len(groups)}")
+        # 6. Final result
+        groups = list(label_to_files.values())
+        sizes = [len(g) for g in groups]
+        print(f"[grouped] total distinct groups: {len(groups)}")
 
-    return {"groups": groups, "sizes": sizes}
+        return {"groups": groups, "sizes": sizes}
+
+@app.get("/segments/grouped")
+def group_segment_patterns():
+    return group_segments()
 
 @app.get("/segments/group/{index}")
 def get_segment_group(index: int):
     INPUT_DIR = "enrich_graph_db"
     graphs = []
 
-    for fname in sorted(os.listdir(INPUT_DIR)):
-        if fname.endswith('.pkl'):
-            with open(os.path.join(INPUT_DIR, fname), 'rb') as f:
-                G = pickle.load(f)
-            seg_nodes = [n for n, d in G.nodes(data=True) if d.get("type") == "segment"]
-            H = G.subgraph(seg_nodes).copy()
-            graphs.append((fname, H))
+    with _PIPELINE_LOCK:
+        for fname in sorted(os.listdir(INPUT_DIR)):
+            if fname.endswith('.pkl'):
+                with open(os.path.join(INPUT_DIR, fname), 'rb') as f:
+                    G = pickle.load(f)
+                seg_nodes = [n for n, d in G.nodes(data=True) if d.get("type") == "segment"]
+                H = G.subgraph(seg_nodes).copy()
+                graphs.append((fname, H))
 
     def get_canonical_label(G):
         for u, v, data in G.edges(data=True):
@@ -1198,18 +2807,16 @@ def pattern_combos(
     gid_set = set(gids.split(",")) if gids else None
 
     combo_counts = Counter()
-    for entry in app.state.mined_patterns:
+    for (desc, gid, combo), cnt in getattr(app.state, 'mined_combos', {}).items():
         # filter by pattern
-        if normalize_dfs(entry["pattern"]) != norm_q:
+        if normalize_dfs(desc) != norm_q:
             continue
         # if they passed in a gid list, only count those
-        if gid_set and entry["gid"] not in gid_set:
+        if gid_set and gid not in gid_set:
             continue
 
         # tally room-type combo
-        G = load_graph_pickle(entry["gid"])
-        combo = tuple(sorted(G.nodes[r]["roomtype"] for r in entry["rooms"]))
-        combo_counts[combo] += 1
+        combo_counts[combo] += cnt
 
     if not combo_counts:
         raise HTTPException(404, f"No matches for pattern {decoded} in given graphs")
@@ -1218,3 +2825,69 @@ def pattern_combos(
         {"combo": list(combo), "count": cnt}
         for combo, cnt in combo_counts.items()
     ]
+
+# ----------------------------------------------------------------------
+# Job endpoints: same work as the synchronous routes, run in the background
+# ----------------------------------------------------------------------
+@app.post("/jobs/process_all")
+def submit_process_all(
+    workers:        int   = Query(1, ge=1, description="Number of worker processes"),
+    buffer_dist:    float = Query(0.6, gt=0),
+    min_shared_len: float = Query(0.1),
+    incremental:    bool  = Query(True, description="Only rebuild apartments whose content or parameters changed"),
+    dataset:        str   = Query(None, description="Open this stored dataset instead of the last upload"),
+):
+    # the dataset current now, not whatever is uploaded while the job waits
+    ds = _use_dataset(dataset)
+    job = submit_job("process_all", functools.partial(_process_all_job, ds), workers=workers,
+                     buffer_dist=buffer_dist, min_shared_len=min_shared_len, incremental=incremental)
+    return {"job_id": job["id"]}
+
+def _process_all_job(dataset, job=None, **kwargs):
+    result = build_all_graphs(dataset, job=job, **kwargs)
+    return {"message": "Processed all floors", **result}
+
+@app.post("/jobs/mine")
+def submit_mine(params: MineParams = Depends()):
+    job = submit_job("mine", _mine_job, **vars(params))
+    return {"job_id": job["id"]}
+
+def _mine_job(job=None, **kwargs):
+    """iter_mine for a job: entries are only kept as the job's partial results."""
+    for kind, payload in iter_mine(job=job, **kwargs):
+        if kind == "summary":
+            return payload
+
+@app.post("/jobs/metrics/excel")
+def submit_metrics_excel():
+    """Build pattern_metrics.xlsx from the last /mine metrics in the background; fetch it from GET /metrics/excel."""
+    if current_metrics_file() is None:
+        raise HTTPException(404, "No metrics yet; run /mine first.")
+    job = submit_job("metrics_excel", write_metrics_excel)
+    return {"job_id": job["id"]}
+
+@app.post("/jobs/segments/grouped")
+def submit_group_segments():
+    job = submit_job("segments_grouped", group_segments)
+    return {"job_id": job["id"]}
+
+@app.get("/jobs")
+def list_jobs():
+    with _JOBS_LOCK:
+        jobs = list(JOBS.values())
+    return [{k: v for k, v in job_view(j).items() if k not in ("partial", "result")} for j in jobs]
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, partial_from: int = Query(0, ge=0, description="Skip partial results already received")):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job_view(job, partial_from)
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    job["cancel"].set()
+    return {"job_id": job_id, "status": job["status"]}
@@ -0,0 +1,80 @@
+"""
+Benchmark for the wall-wall pass of build_graph_for_apartment.
+
+Builds synthetic floors whose walls form a grid of thin rectangles and times
+add_wall_wall_edges against the former all-pairs loop. The cost per wall of
+the indexed version should stay roughly flat as the wall count grows.
+
+Run from this folder:  python bench_wall_edges.py
+"""
+import time
+from itertools import combinations
+
+import networkx as nx
+from shapely.geometry import box
+
+from app.main import add_wall_wall_edges
+
+WALL_T = 0.2
+CELL = 4.0
+
+
+def grid_walls(n_cells):
+    """Horizontal and vertical wall rectangles of an n_cells x n_cells grid."""
+    walls = []
+    span = n_cells * CELL + WALL_T
+    for k in range(n_cells + 1):
+        c = k * CELL
+        walls.append(box(0, c, span, c + WALL_T))
+        walls.append(box(c, 0, c + WALL_T, span))
+    # split long walls into per-cell pieces, as MSD exports them
+    pieces = []
+    for w in walls:
+        x0, y0, x1, y1 = w.bounds
+        if x1 - x0 > y1 - y0:
+            pieces += [box(x, y0, min(x + CELL + WALL_T, x1), y1) for x in range(0, int(x1), int(CELL))]
+        else:
+            pieces += [box(x0, y, x1, min(y + CELL + WALL_T, y1)) for y in range(0, int(y1), int(CELL))]
+    return pieces
+
+
+def wall_graph(walls):
+    G = nx.Graph()
+    for i, g in enumerate(walls):
+        G.add_node(f"wall_{i}", type='wall', geometry=g)
+    return G
+
+
+def pairwise_wall_edges(G):
+    """The former all-pairs implementation, kept for comparison."""
+    walls = [n for n, d in G.nodes(data=True) if d.get('type') == 'wall']
+    for u, v in combinations(walls, 2):
+        gu, gv = G.nodes[u]['geometry'], G.nodes[v]['geometry']
+        if gu.touches(gv) or gu.intersects(gv):
+            slen = getattr(gu.boundary.intersection(gv.boundary), 'length', 0.0)
+            G.add_edge(u, v, edge_type='wall-wall', shared_length=slen)
+    return G
+
+
+def timed(fn, G, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        H = G.copy()
+        t0 = time.perf_counter()
+        fn(H)
+        best = min(best, time.perf_counter() - t0)
+    return best, H
+
+
+if __name__ == "__main__":
+    print(f"{'walls':>6} {'edges':>6} {'indexed us/wall':>16} {'pairwise us/wall':>17}")
+    for n_cells in (4, 8, 12, 16, 24):
+        G = wall_graph(grid_walls(n_cells))
+        n = G.number_of_nodes()
+        t_idx, H = timed(add_wall_wall_edges, G)
+        line = f"{n:>6} {H.number_of_edges():>6} {1e6 * t_idx / n:>16.1f}"
+        if n <= 700:
+            t_pair, P = timed(pairwise_wall_edges, G, repeat=1)
+            assert sorted(P.edges) == sorted(H.edges)
+            line += f" {1e6 * t_pair / n:>17.1f}"
+        print(line)
@@ -0,0 +1,117 @@
+"""
+Equivalence checks for the faster mining and scoring paths of /mine.
+
+Builds a dozen small synthetic apartments and asserts that
+  - mine_partitioned (SON shards) finds the same patterns and supports as
+    mine_frequent_patterns,
+  - enumerate_modules (engine=esu) yields the same patterns, supports and
+    match rows as gSpan followed by iter_match_table (engine=gspan),
+  - score_shape_violations gives the same numbers as the per-match loop
+    it replaced.
+
+Run from this folder:  python check_equivalence.py
+"""
+import random
+
+import networkx as nx
+import numpy as np
+from shapely.geometry import MultiLineString, MultiPoint, MultiPolygon, Polygon, box
+
+from app.main import (compact_geometries, compact_graph, enumerate_modules, iter_match_table,
+                      mine_frequent_patterns, mine_partitioned, score_shape_violations)
+
+ROOMTYPES = ("Bedroom", "Kitchen", "Bathroom", "Livingroom")
+N_APARTMENTS = 12
+MIN_SUPPORT = 3
+MIN_VERTICES, MAX_VERTICES = 2, 4
+
+
+def apartment_graph(apt, rng):
+    """
+    Rooms of a 3-column apartment: each column has its own width and is cut
+    into two rooms at its own height, so rooms are rectangles of different
+    sizes and neighbouring columns do not line up.
+    """
+    G = nx.Graph()
+    G.add_node(f"apartment_{apt}", type='apartment', apartment_id=apt)
+    rooms, x = [], 0.0
+    for _ in range(3):
+        w, cut = rng.uniform(2.5, 5.0), rng.uniform(2.0, 4.0)
+        rooms += [box(x, 0.0, x + w, cut), box(x, cut, x + w, 6.0)]
+        x += w
+    names = []
+    for k, geom in enumerate(rooms):
+        names.append(f"room_{apt}_{k}")
+        G.add_node(names[-1], type='room', roomtype=rng.choice(ROOMTYPES), apartment_id=apt, geometry=geom)
+        G.add_edge(f"apartment_{apt}", names[-1], edge_type='apartment-room')
+    for i in range(len(rooms)):
+        for j in range(i + 1, len(rooms)):
+            shared = rooms[i].intersection(rooms[j]).length
+            if shared > 0:
+                G.add_edge(names[i], names[j], edge_type='room-room', shared_length=shared)
+    return G
+
+
+def fixture():
+    rng = random.Random(0)
+    return [(f"0_A{a}", compact_graph(apartment_graph(f"A{a}", rng), f"0_A{a}")) for a in range(N_APARTMENTS)]
+
+
+def by_description(patterns):
+    return {p["description"]: p["support"] for p in patterns}
+
+
+def row_keys(rows, patterns):
+    return sorted((patterns[r["pattern"]]["description"], r["gid"], r["rooms"], tuple(sorted(r["mapping"].items())))
+                  for r in rows)
+
+
+def loop_shape_violation(room_polys, threshold):
+    """The former per-match shape score: (viol, ratio, hausd, width)."""
+    coords, lines = [], []
+    for poly in room_polys:
+        for p in (poly.geoms if isinstance(poly, MultiPolygon) else [poly]):
+            if isinstance(p, Polygon):
+                coords.extend(p.exterior.coords)
+                lines.append(p.exterior)
+    rect = MultiPoint(coords).convex_hull.minimum_rotated_rectangle
+    hausd = MultiLineString(lines).hausdorff_distance(rect.exterior)
+    avg = rect.length / 4.0
+    ratio = hausd / avg if avg else 999
+    pts = list(rect.exterior.coords)
+    width = min(np.hypot(pts[i + 1][0] - pts[i][0], pts[i + 1][1] - pts[i][1]) for i in range(len(pts) - 1))
+    return max(0.0, ratio - threshold), ratio, hausd, width
+
+
+def check_son(graphs):
+    full = mine_frequent_patterns(graphs, MIN_SUPPORT, MIN_VERTICES, MAX_VERTICES)
+    for shards in (2, 3, 5):
+        assert by_description(mine_partitioned(graphs, MIN_SUPPORT, MIN_VERTICES, MAX_VERTICES,
+                                               shards=shards)) == by_description(full), shards
+    return len(full)
+
+
+def check_esu(graphs):
+    patterns = mine_frequent_patterns(graphs, MIN_SUPPORT, MIN_VERTICES, MAX_VERTICES)
+    rows = list(iter_match_table(patterns, graphs))
+    esu_patterns, esu_rows = enumerate_modules(graphs, MIN_SUPPORT, MIN_VERTICES, MAX_VERTICES)
+    assert by_description(esu_patterns) == by_description(patterns)
+    assert row_keys(esu_rows, esu_patterns) == row_keys(rows, patterns)
+    return patterns, rows
+
+
+def check_scorer(graphs, rows, threshold=0.3):
+    graph_by_gid = dict(graphs)
+    matches = [compact_geometries(graph_by_gid[r["gid"]], list(r["rooms"])) for r in rows]
+    vectorized = np.column_stack(score_shape_violations(matches, threshold))
+    loop = np.array([loop_shape_violation(polys, threshold) for polys in matches])
+    assert np.array_equal(vectorized, loop)
+    return len(matches)
+
+
+if __name__ == "__main__":
+    graphs = fixture()
+    print(f"SON == full mining: {check_son(graphs)} patterns")
+    patterns, rows = check_esu(graphs)
+    print(f"ESU == gSpan + matching: {len(patterns)} patterns, {len(rows)} rows")
+    print(f"vectorized scorer == per-match loop: {check_scorer(graphs, rows)} matches")